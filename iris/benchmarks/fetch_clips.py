@@ -0,0 +1,93 @@
+"""
+Download the clips listed in clips.json into a corpus directory, checking each
+against its sha256, and convert them to the 16 kHz, 16 bit mono wav files the
+benchmarks read. Each clip's transcript goes next to it as <name>.txt.
+
+    python benchmarks/fetch_clips.py --output corpus/clips
+
+Clips without a sha256 in the manifest are refused unless --pin is given, which
+writes the hash of what was downloaded back into clips.json. Review and commit that
+change so later runs are checked against the same audio.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import urllib.request
+import wave
+
+import numpy as np
+from fixtures import SAMPLE_RATE
+
+MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "clips.json")
+
+
+def download(url: str) -> bytes:
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return response.read()
+
+
+def to_pcm(data: bytes) -> np.ndarray:
+    """Decode any format libsndfile reads into 16 kHz mono int16"""
+    import soundfile
+
+    audio, rate = soundfile.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    audio = audio.mean(axis=1)
+    if rate != SAMPLE_RATE:
+        # Linear interpolation is plenty for a benchmark corpus
+        times = np.arange(0, len(audio) / rate, 1 / SAMPLE_RATE)
+        audio = np.interp(times, np.arange(len(audio)) / rate, audio)
+    return (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+
+
+def write_wav(path: str, pcm: np.ndarray):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", default="corpus/clips")
+    parser.add_argument(
+        "--pin", action="store_true", help="Record hashes missing from clips.json"
+    )
+    args = parser.parse_args()
+
+    with open(MANIFEST) as f:
+        manifest = json.load(f)
+
+    os.makedirs(args.output, exist_ok=True)
+    pinned = False
+    for clip in manifest["clips"]:
+        data = download(clip["url"])
+        digest = hashlib.sha256(data).hexdigest()
+        if clip.get("sha256") is None:
+            if not args.pin:
+                raise SystemExit(f"{clip['name']} has no sha256, rerun with --pin")
+            clip["sha256"] = digest
+            pinned = True
+        elif digest != clip["sha256"]:
+            raise SystemExit(
+                f"{clip['name']} doesn't match clips.json: got sha256 {digest}"
+            )
+
+        path = os.path.join(args.output, clip["name"])
+        write_wav(path + ".wav", to_pcm(data))
+        with open(path + ".txt", "w") as f:
+            f.write(clip["text"] + "\n")
+        print(f"{clip['name']}: {digest}")
+
+    if pinned:
+        with open(MANIFEST, "w") as f:
+            json.dump(manifest, f, indent=2)
+            f.write("\n")
+        print("Pinned new hashes in clips.json")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Loading the benchmark corpus. See README.md for the layout. Nothing here is
+bundled with the repo, point the benchmarks at a local copy.
+"""
+
+import os
+import wave
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+@dataclass
+class Clip:
+    name: str
+    path: str
+    # Reference transcript from <name>.txt, if there is one
+    text: Optional[str] = None
+    # Float32 samples. Loaded up front for wav files, Ogg/Opus clips are left for
+    # the benchmark to decode.
+    audio: Optional[np.ndarray] = None
+
+    @property
+    def is_opus(self) -> bool:
+        return self.path.endswith((".ogg", ".opus"))
+
+    @property
+    def seconds(self) -> float:
+        return len(self.audio) / SAMPLE_RATE
+
+
+def read_wav(path: str) -> np.ndarray:
+    with wave.open(path, "rb") as f:
+        if (f.getnchannels(), f.getsampwidth(), f.getframerate()) != (
+            1,
+            2,
+            SAMPLE_RATE,
+        ):
+            raise ValueError(f"{path} has to be 16 kHz, 16 bit mono")
+        pcm = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+    return pcm.astype(np.float32) / 32768
+
+
+def load_clips(directory: str, opus: bool = False) -> list[Clip]:
+    """The clips in directory, including Ogg/Opus ones if opus is set"""
+    extensions = (".wav", ".ogg", ".opus") if opus else (".wav",)
+    clips = []
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        if ext not in extensions:
+            continue
+
+        text = None
+        if os.path.exists(os.path.join(directory, stem + ".txt")):
+            with open(os.path.join(directory, stem + ".txt")) as f:
+                text = f.read().strip()
+        clip = Clip(name=name, path=os.path.join(directory, name), text=text)
+        if not clip.is_opus:
+            clip.audio = read_wav(clip.path)
+        clips.append(clip)
+
+    if not clips:
+        raise ValueError(f"No {'/'.join(extensions)} clips in {directory}")
+    return clips
+
+
+def load_sentences(path: str) -> list[str]:
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, (50, 95, 99)).tolist()
+    return {"p50": p50, "p95": p95, "p99": p99, "mean": float(np.mean(values))}
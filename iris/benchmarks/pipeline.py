@@ -0,0 +1,415 @@
+"""
+Replay recorded clips through the server pipeline in one process: Opus decoding,
+VADHandler, Transcriber, Translator and MessageBroker, with a local stand-in for
+the client's websocket. Reports throughput, per-stage latency, real-time factor
+and peak RSS as JSON.
+
+    python benchmarks/pipeline.py --clips corpus/clips --output run.json
+
+With --streams N, N users send every utterance at once instead, through the
+server's TranscriberPool and BrokerThread, so clips are batched and spread over
+the transcriber workers the way they are under load.
+
+Server settings come from IRIS_* environment variables as usual, so the same
+corpus can be run against different configurations. Messages and audio are
+written to a temporary directory unless IRIS_DATA_PATH is set.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from uuid import uuid4
+
+# Has to be set before iris.server reads its settings
+os.environ.setdefault("IRIS_DATA_PATH", tempfile.mkdtemp(prefix="iris-bench-"))
+
+import numpy as np
+import pyogg
+from fixtures import SAMPLE_RATE, Clip, load_clips, percentiles
+from mutagen.ogg import OggPage
+from starlette.websockets import WebSocketState
+
+from iris.model_registry import configure_registry
+from iris.server import MessageBroker, audio_in_q, settings, whisper_out_q
+from iris.server.models import StreamMessage, StreamMode, TranscriptionMessage
+from iris.server.persistence import get_writer
+from iris.server.shared_audio import SlabPool, get_slab_pool
+from iris.server.transcription import Transcriber, Translator
+from iris.server.vad import VADHandler
+from iris.server.websocket_stream import BYTES_PER_SILERO_FRAME, chunks, decode
+from iris.server.workers import BrokerThread, TranscriberPool
+from iris.vad_model import get_vad_model
+
+USER = "benchmark"
+
+
+class FakeWebSocket:
+    """Takes the place of a client connection and records when each message lands"""
+
+    client_state = WebSocketState.CONNECTED
+    application_state = WebSocketState.CONNECTED
+
+    def __init__(self):
+        self.received: asyncio.Queue = asyncio.Queue()
+
+    async def send_bytes(self, data):
+        self.received.put_nowait((time.perf_counter(), data))
+
+    async def send_text(self, data):
+        self.received.put_nowait((time.perf_counter(), data))
+
+    async def close(self):
+        self.application_state = WebSocketState.DISCONNECTED
+
+
+def ogg_pages(path: str) -> list[bytes]:
+    """The clip split into Ogg pages, which is how the browser sends it"""
+    pages = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                pages.append(OggPage(f).write())
+            except EOFError:
+                return pages
+
+
+def pcm_frames(audio: np.ndarray) -> list[bytes]:
+    pcm = (np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes()
+    return [
+        frame
+        for frame in chunks(pcm, BYTES_PER_SILERO_FRAME)
+        if len(frame) == BYTES_PER_SILERO_FRAME
+    ]
+
+
+def decode_opus(path: str) -> list[bytes]:
+    decoder = pyogg.OpusDecoder()
+    decoder.set_channels(1)
+    decoder.set_sampling_frequency(SAMPLE_RATE)
+
+    frames, remainder = [], None
+    for page in ogg_pages(path):
+        new_frames, remainder = decode({"bytes": page}, decoder, remainder)
+        frames.extend(new_frames)
+    return frames
+
+
+def split_utterances(frames: list[bytes]) -> list[np.ndarray]:
+    utterances = []
+    handler = VADHandler(on_data_ready=utterances.append)
+    for frame in frames:
+        handler.vad(frame)
+    handler.send_audio()
+    return utterances
+
+
+class Pipeline:
+    def __init__(self, language: str):
+        self.language = language
+        self.transcriber = Transcriber()
+        self.translator = Translator()
+        self.broker = MessageBroker(settings.broker_queue_size)
+        self.socket = FakeWebSocket()
+        self.stages: dict[str, list[float]] = defaultdict(list)
+        self.utterances = 0
+
+    def decode(self, clip: Clip) -> list[bytes]:
+        if not clip.is_opus:
+            return pcm_frames(clip.audio)
+
+        start = time.perf_counter()
+        frames = decode_opus(clip.path)
+        self.stages["decode"].append(time.perf_counter() - start)
+
+        pcm = np.frombuffer(b"".join(frames), dtype=np.int16)
+        clip.audio = pcm.astype(np.float32) / 32768
+        return frames
+
+    def vad(self, frames: list[bytes]) -> list[np.ndarray]:
+        start = time.perf_counter()
+        utterances = split_utterances(frames)
+        self.stages["vad"].append(time.perf_counter() - start)
+        return utterances
+
+    async def process(self, audio: np.ndarray):
+        msg = TranscriptionMessage(
+            user=USER,
+            language=self.language,
+            recording_meta=StreamMessage(mode=StreamMode.CONVERSATION),
+            audio=audio,
+        )
+        start = time.perf_counter()
+        m = self.transcriber.transcribe_batch([msg])[0]
+        whisper_end = time.perf_counter()
+        self.stages["whisper"].append(whisper_end - start)
+        if m is None:
+            return
+
+        # Same targets as BrokerThread.translate_and_send
+        if m.language == settings.base_language:
+            targets = settings.supported_languages
+        else:
+            targets = [settings.base_language]
+        translations = self.translator.translate_batch(
+            [(m.text, (m.language, lang)) for lang in targets]
+        )
+        m.translated_text.update(zip(targets, translations))
+        translate_end = time.perf_counter()
+        self.stages["translate"].append(translate_end - whisper_end)
+
+        await self.broker.send(m, key=str(m.id))
+        received_at, _ = await self.socket.received.get()
+        self.stages["broadcast"].append(received_at - translate_end)
+        self.stages["utterance"].append(received_at - start)
+        self.utterances += 1
+
+    async def run_clip(self, clip: Clip):
+        start = time.perf_counter()
+        for audio in self.vad(self.decode(clip)):
+            await self.process(audio)
+        self.stages["clip"].append(time.perf_counter() - start)
+
+    def reset(self):
+        self.stages.clear()
+        self.utterances = 0
+
+
+class Streams:
+    """
+    Several users talking at once. Utterances go on the server's audio queue the
+    way AudioStream queues them and come back through the TranscriberPool,
+    BrokerThread and MessageBroker.
+    """
+
+    def __init__(self, language: str):
+        self.language = language
+        self.slabs: SlabPool = get_slab_pool()
+        self.broker = MessageBroker(settings.broker_queue_size)
+        self.socket = FakeWebSocket()
+        self.pool = TranscriberPool(
+            audio_in_q,
+            whisper_out_q,
+            self.slabs,
+            settings.transcriber_workers,
+            reorder_timeout=settings.reorder_timeout_seconds,
+        )
+        self.broker_thread = BrokerThread(whisper_out_q, self.broker)
+        # message id -> perf_counter() when it was queued
+        self.queued_at: dict[str, float] = {}
+        self.seq: dict[str, int] = defaultdict(int)
+
+    def start(self):
+        self.broker.register(self.socket)
+        self.pool.start()
+        self.broker_thread.start()
+
+    def send(self, user: str, utterances: list[np.ndarray]):
+        """Queue a user's utterances, blocking while the audio queue is full"""
+        for audio in utterances:
+            seq = self.seq[user]
+            self.seq[user] += 1
+            msg = TranscriptionMessage(
+                user=user,
+                language=self.language,
+                recording_meta=StreamMessage(mode=StreamMode.CONVERSATION),
+                message_id=uuid4(),
+                seq=seq,
+            )
+            msg.audio_ref = self.slabs.put(audio)
+            if msg.audio_ref is None:
+                msg.audio = audio
+            else:
+                self.slabs.claim(msg.audio_ref, (user, seq))
+            now = time.time()
+            msg.timings = {"speech_end": now, "vad": now}
+            self.queued_at[str(msg.message_id)] = time.perf_counter()
+            audio_in_q.put(msg)
+
+    async def wait_for(self, count: int, timeout: float = 600):
+        """Wait for count messages, or until nothing has arrived for timeout"""
+        for _ in range(count):
+            try:
+                await asyncio.wait_for(self.socket.received.get(), timeout)
+            except asyncio.TimeoutError:
+                return
+
+    async def stop(self):
+        """Let everything queued so far get delivered, then stop"""
+        await asyncio.to_thread(self.pool.stop, 600)
+        await asyncio.to_thread(whisper_out_q.put, None)
+        await asyncio.to_thread(self.broker_thread.join)
+        for channel in self.broker.sockets.values():
+            while channel.queue:
+                await asyncio.sleep(0.01)
+
+    def latencies(self) -> list[tuple[float, float]]:
+        """(time received, seconds since it was queued) for each message"""
+        out = []
+        while not self.socket.received.empty():
+            received_at, data = self.socket.received.get_nowait()
+            queued_at = self.queued_at.pop(json.loads(data)["id"], None)
+            if queued_at is not None:
+                out.append((received_at, received_at - queued_at))
+        return out
+
+
+async def run_streams(args, clips: list[Clip]) -> dict:
+    # VAD isn't what this measures, so the corpus is split up front
+    utterances = []
+    for clip in clips:
+        frames = decode_opus(clip.path) if clip.is_opus else pcm_frames(clip.audio)
+        utterances.extend(split_utterances(frames))
+
+    get_vad_model()
+    configure_registry(settings)
+    streams = Streams(args.language)
+    streams.start()
+
+    # Workers load their models after they start, wait for them to answer
+    for _ in range(args.warmup):
+        streams.send("warmup", utterances[:1])
+        await streams.wait_for(1)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            asyncio.to_thread(streams.send, f"{USER}-{i}", utterances * args.repeat)
+            for i in range(args.streams)
+        )
+    )
+    await streams.stop()
+    get_writer().stop(timeout=30)
+
+    received = streams.latencies()
+    wall = max((at for at, _ in received), default=time.perf_counter()) - start
+    sent = args.streams * args.repeat * len(utterances)
+    audio_seconds = (
+        args.streams * args.repeat * sum(len(u) for u in utterances) / SAMPLE_RATE
+    )
+    return {
+        "commit": git_commit(),
+        "config": {
+            "whisper_model": settings.whisper_model,
+            "whisper_fast_model": settings.whisper_fast_model,
+            "performance_profile": settings.performance_profile,
+            "translation_backend": settings.translation_backend,
+            "whisper_cpu_threads": settings.whisper_cpu_threads,
+            "transcriber_workers": settings.transcriber_workers,
+            "transcribe_batch_size": settings.transcribe_batch_size,
+            "language": args.language,
+        },
+        "streams": args.streams,
+        "utterances": sent,
+        "delivered": len(received),
+        "audio_seconds": audio_seconds,
+        "wall_seconds": wall,
+        "throughput": {
+            "utterances_per_second": len(received) / wall,
+            "audio_seconds_per_second": audio_seconds / wall,
+        },
+        "real_time_factor": wall / audio_seconds,
+        "stages": {"utterance": percentiles([latency for _, latency in received])},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes everywhere else
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        )
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+async def run(args) -> dict:
+    clips = load_clips(args.clips, opus=True)
+    if args.streams:
+        return await run_streams(args, clips)
+
+    get_vad_model()
+    configure_registry(settings)
+    pipeline = Pipeline(args.language)
+    pipeline.broker.register(pipeline.socket)
+
+    for clip in clips[: args.warmup]:
+        await pipeline.run_clip(clip)
+    pipeline.reset()
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for clip in clips:
+            await pipeline.run_clip(clip)
+    wall = time.perf_counter() - start
+    get_writer().stop(timeout=30)
+
+    audio_seconds = args.repeat * sum(clip.seconds for clip in clips)
+    return {
+        "commit": git_commit(),
+        "config": {
+            "whisper_model": settings.whisper_model,
+            "whisper_fast_model": settings.whisper_fast_model,
+            "performance_profile": settings.performance_profile,
+            "translation_backend": settings.translation_backend,
+            "whisper_cpu_threads": settings.whisper_cpu_threads,
+            "language": args.language,
+        },
+        "clips": len(clips) * args.repeat,
+        "utterances": pipeline.utterances,
+        "audio_seconds": audio_seconds,
+        "wall_seconds": wall,
+        "throughput": {
+            "clips_per_second": len(clips) * args.repeat / wall,
+            "audio_seconds_per_second": audio_seconds / wall,
+        },
+        "real_time_factor": wall / audio_seconds,
+        "stages": {
+            stage: percentiles(values) for stage, values in pipeline.stages.items()
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--clips", required=True, help="Directory of wav and Ogg/Opus clips"
+    )
+    parser.add_argument("--language", default="en", help="Language spoken in clips")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--warmup", type=int, default=1, help="Clips to run before measuring"
+    )
+    parser.add_argument(
+        "--streams",
+        type=int,
+        default=0,
+        help="Users sending at once through the transcriber pool, 0 for one clip "
+        "at a time in this process",
+    )
+    parser.add_argument("--output", help="Write the JSON report here too")
+    args = parser.parse_args()
+
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Compare the performance profiles in iris.profiles. Every profile transcribes the
+same clips and translates the same sentences, and the output is compared with the
+first profile's (normally "default") to show how much each one drifts.
+
+    python benchmarks/profiles.py --clips corpus/clips --sentences corpus/en.txt
+"""
+
+import argparse
+import json
+import time
+
+import faster_whisper
+from fixtures import load_clips, load_sentences, percentiles
+
+from iris.model_registry import load_pipeline
+from iris.profiles import PROFILES, get_profile
+
+try:
+    import sacrebleu
+except ImportError:
+    sacrebleu = None
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    ref = reference.lower().split()
+    hyp = hypothesis.lower().split()
+    if not ref:
+        return float(bool(hyp))
+
+    # Word level edit distance, one row at a time
+    row = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (r != h))
+    return row[-1] / len(ref)
+
+
+def corpus_wer(references: list[str], hypotheses: list[str]) -> float:
+    words = sum(len(r.split()) for r in references)
+    errors = sum(
+        word_error_rate(r, h) * len(r.split()) for r, h in zip(references, hypotheses)
+    )
+    return errors / max(words, 1)
+
+
+def bleu(references: list[str], hypotheses: list[str]):
+    if sacrebleu is None:
+        return None
+    return sacrebleu.corpus_bleu(hypotheses, [references]).score
+
+
+def run_whisper(args, compute_type: str, clips) -> tuple[list[str], dict]:
+    model = faster_whisper.WhisperModel(
+        args.whisper_model,
+        device=args.device,
+        compute_type=compute_type,
+        cpu_threads=args.cpu_threads,
+    )
+    # Keep the first call's setup cost out of the numbers. Segments are generated
+    # lazily, so nothing is decoded until they're read.
+    list(model.transcribe(clips[0].audio, language=args.language)[0])
+
+    texts, latencies = [], []
+    audio_seconds = 0.0
+    for clip in clips:
+        start = time.perf_counter()
+        segments, _ = model.transcribe(clip.audio, language=args.language, beam_size=5)
+        texts.append(" ".join(seg.text for seg in segments).strip())
+        latencies.append(time.perf_counter() - start)
+        audio_seconds += clip.seconds
+
+    return texts, {
+        "latency": percentiles(latencies),
+        "real_time_factor": sum(latencies) / audio_seconds,
+    }
+
+
+def run_translation(args, precision: str, sentences) -> tuple[list[str], dict]:
+    pipe = load_pipeline("translation", args.translation_model, args.device, precision)
+    pipe(sentences[0])
+
+    texts, latencies = [], []
+    for sentence in sentences:
+        start = time.perf_counter()
+        texts.append(pipe(sentence)[0]["translation_text"])
+        latencies.append(time.perf_counter() - start)
+    return texts, {"latency": percentiles(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clips", help="Directory of 16 kHz mono wav files")
+    parser.add_argument("--sentences", help="Text file with one sentence per line")
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--whisper-model", default="base")
+    parser.add_argument("--translation-model", default="Helsinki-NLP/opus-mt-en-es")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--cpu-threads", type=int, default=4)
+    parser.add_argument("--output", help="Write the JSON report here too")
+    args = parser.parse_args()
+
+    clips = load_clips(args.clips) if args.clips else []
+    sentences = load_sentences(args.sentences) if args.sentences else []
+    if not clips and not sentences:
+        parser.error("give --clips, --sentences or both")
+
+    report = {"clips": len(clips), "sentences": len(sentences), "profiles": {}}
+    baseline_transcripts = baseline_translations = None
+    for name in args.profiles.split(","):
+        profile = get_profile(name, args.device)
+        result = {
+            "whisper_compute_type": profile.whisper_compute_type,
+            "translation_precision": profile.translation_precision,
+        }
+
+        if clips:
+            texts, result["whisper"] = run_whisper(
+                args, profile.whisper_compute_type, clips
+            )
+            baseline_transcripts = baseline_transcripts or texts
+            result["whisper"]["wer_drift"] = corpus_wer(baseline_transcripts, texts)
+            references = [clip.text for clip in clips]
+            if all(references):
+                result["whisper"]["wer"] = corpus_wer(references, texts)
+
+        if sentences:
+            texts, result["translation"] = run_translation(
+                args, profile.translation_precision, sentences
+            )
+            baseline_translations = baseline_translations or texts
+            result["translation"]["bleu_vs_baseline"] = bleu(
+                baseline_translations, texts
+            )
+
+        report["profiles"][name] = result
+        print(name, json.dumps(result))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
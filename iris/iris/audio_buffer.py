@@ -0,0 +1,102 @@
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+class AudioBuffer:
+    """
+    Preallocated buffer for the pre-roll and the current recording. Frames are
+    converted to float32 once as they are written, so an utterance comes out as a
+    single slice instead of being joined and converted again.
+
+    A frame is written first and only kept once commit() is called, which lets VAD
+    look at the frame before deciding whether it belongs to the recording.
+    """
+
+    def __init__(self, preroll_samples: int, capacity_seconds: float = 30):
+        self.preroll_samples = preroll_samples
+        capacity = max(int(capacity_seconds * SAMPLE_RATE), 4 * preroll_samples)
+        self.pcm = np.zeros(capacity, dtype=np.int16)
+        self.audio = np.zeros(capacity, dtype=np.float32)
+
+        self.start = 0
+        self.end = 0
+        self.recorded_samples = 0
+
+        self._pending = 0
+        self._pending_frame = None
+
+    def __len__(self):
+        return self.end - self.start
+
+    def write(self, frame: bytes) -> np.ndarray:
+        """
+        Write an int16 frame after the kept audio and return it as float32. Writing
+        again before commit() replaces the frame.
+        """
+        if frame is self._pending_frame:
+            return self.audio[self.end : self.end + self._pending]
+
+        samples = np.frombuffer(frame, dtype=np.int16)
+        n = len(samples)
+        self._reserve(n)
+
+        pcm = self.pcm[self.end : self.end + n]
+        pcm[:] = samples
+        audio = self.audio[self.end : self.end + n]
+        np.multiply(pcm, 1 / 32768, out=audio, casting="same_kind")
+
+        self._pending = n
+        self._pending_frame = frame
+        return audio
+
+    def commit(self, recording: bool):
+        """
+        Keep the last written frame. Outside of a recording only the last
+        preroll_samples are kept.
+        """
+        self.end += self._pending
+        if recording:
+            self.recorded_samples += self._pending
+        elif self.recorded_samples == 0:
+            self.start = max(self.start, self.end - self.preroll_samples)
+
+        self._pending = 0
+        self._pending_frame = None
+
+    def get_audio(self) -> np.ndarray:
+        # Copied because the buffer will be written over by the next recording
+        return self.audio[self.start : self.end].copy()
+
+    def get_pcm(self) -> np.ndarray:
+        return self.pcm[self.start : self.end].copy()
+
+    def clear(self):
+        self.start = 0
+        self.end = 0
+        self.recorded_samples = 0
+        self._pending = 0
+        self._pending_frame = None
+
+    def _reserve(self, n: int):
+        if self.end + n <= len(self.pcm):
+            return
+
+        kept = self.end - self.start
+        if kept + n > len(self.pcm) // 2:
+            # Long recording, double the buffer
+            size = 2 * max(len(self.pcm), kept + n)
+            self.pcm = np.concatenate(
+                [self.pcm[self.start : self.end], np.zeros(size - kept, np.int16)]
+            )
+            self.audio = np.concatenate(
+                [self.audio[self.start : self.end], np.zeros(size - kept, np.float32)]
+            )
+        else:
+            # Only the pre-roll or a short recording is left at the end of the
+            # buffer, move it back to the front
+            self.pcm[:kept] = self.pcm[self.start : self.end]
+            self.audio[:kept] = self.audio[self.start : self.end]
+
+        self.start = 0
+        self.end = kept
@@ -0,0 +1,88 @@
+import os
+from threading import Lock
+from typing import Optional, Union
+
+import ctranslate2
+from transformers import AutoTokenizer
+
+# Precisions from iris.profiles -> CTranslate2 compute types
+COMPUTE_TYPES = {"fp32": "default", "int8": "int8", "bf16": "bfloat16"}
+
+
+class CT2TranslationPipeline:
+    """
+    A Marian (opus-mt) or mbart model run through CTranslate2. It's called the same
+    way as a transformers translation pipeline and returns the same
+    [{"translation_text": ...}] list, so it can be swapped in for one.
+
+    The model is converted into model_dir the first time it's used.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        model_dir: str,
+        device: Union[str, int] = "cpu",
+        precision: str = "fp32",
+        inter_threads: int = 1,
+        intra_threads: int = 4,
+        beam_size: int = 4,
+    ):
+        path = os.path.join(model_dir, model.replace("/", "--"))
+        if not os.path.exists(os.path.join(path, "model.bin")):
+            print(f"Converting {model} to CTranslate2 in {path}")
+            converter = ctranslate2.converters.TransformersConverter(model)
+            converter.convert(path, force=True)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model)
+        # mbart's tokenizer keeps the source language as state
+        self._tokenizer_lock = Lock()
+        self.translator = ctranslate2.Translator(
+            path,
+            device="cpu" if device in ("cpu", -1) else "cuda",
+            compute_type=COMPUTE_TYPES[precision],
+            inter_threads=inter_threads,
+            intra_threads=intra_threads,
+        )
+        self.beam_size = beam_size
+        self.nbytes = os.path.getsize(os.path.join(path, "model.bin"))
+
+    def __call__(
+        self,
+        texts: Union[str, list[str]],
+        src_lang: Optional[str] = None,
+        tgt_lang: Optional[str] = None,
+        batch_size: int = 16,
+        **kwargs,
+    ) -> list[dict[str, str]]:
+        if isinstance(texts, str):
+            texts = [texts]
+
+        with self._tokenizer_lock:
+            if src_lang:
+                self.tokenizer.src_lang = src_lang
+            sources = [
+                self.tokenizer.convert_ids_to_tokens(self.tokenizer.encode(text))
+                for text in texts
+            ]
+
+        # mbart has to be told the target language with a prefix token, Marian
+        # models only know the one
+        target_prefix = [[tgt_lang]] * len(sources) if tgt_lang else None
+        results = self.translator.translate_batch(
+            sources,
+            target_prefix=target_prefix,
+            max_batch_size=batch_size,
+            beam_size=self.beam_size,
+        )
+
+        out = []
+        for result in results:
+            tokens = result.hypotheses[0]
+            if tgt_lang:
+                tokens = tokens[1:]
+            text = self.tokenizer.decode(
+                self.tokenizer.convert_tokens_to_ids(tokens), skip_special_tokens=True
+            )
+            out.append({"translation_text": text})
+        return out
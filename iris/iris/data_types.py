@@ -58,11 +58,33 @@ class TTSMsg:
 class Settings:
     model_path: str = "base"
     compute_type: str = "default"
+    # Model precision, one of iris.profiles.PROFILES. An explicit compute_type
+    # still wins for whisper.
+    performance_profile: str = "default"
     gpu_device_index: int = 0
     whisper_device: str = "cpu"
     translation_device: str = "cpu"
+    translation_cache_size: int = 2048
+    translation_cache_path: Optional[str] = None
+    # "transformers", or "ctranslate2" to convert the translation models on first
+    # use and run them with CTranslate2
+    translation_backend: str = "transformers"
+    translation_ct2_dir: str = "ct2_models"
+    translation_inter_threads: int = 1
+    translation_intra_threads: int = 4
+    # Translation and TTS models are unloaded when unused for model_idle_seconds,
+    # or least recently used first to stay under model_memory_budget_mb
+    model_memory_budget_mb: Optional[int] = None
+    model_idle_seconds: float = 1800
     tts_device: str = "cpu"
     beam_size: int = 5
+    batch_size: int = 4
+    batch_wait: float = 0.05
+    # Clips waiting for whisper. Once it's full new clips are dropped, and the UI
+    # shows overload from overload_queue_depth on.
+    transcribe_queue_size: int = 8
+    overload_queue_depth: int = 3
+    tts_queue_size: int = 8
     initial_prompt: Optional[str] = None
     suppress_tokens: List[int] = field(default_factory=default_suppress_tokens)
     external_lang: str = "en"
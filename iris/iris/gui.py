@@ -79,9 +79,11 @@ class UserInterface:
         self.status_indicator.place(relx=0.01, y=5)
         self.tts_label.place(relx=0.95, y=5)
         self.root.bind("<space>", lambda x: self.toggle_tts())
+        self.is_overloaded = False
         self.set_recording_status(RecorderState.OFFLINE)
 
     def set_recording_status(self, state: RecorderState):
+        self.recording_state = state
         status_map = {
             RecorderState.RECORDING: "#ffff00",
             RecorderState.OFFLINE: "#ff0000",
@@ -89,9 +91,20 @@ class UserInterface:
         }
         self.status_indicator.delete("all")
         self.status_indicator.create_oval(
-            0, 0, 20, 20, fill=status_map.get(state, "#000000")
+            2,
+            2,
+            20,
+            20,
+            fill=status_map.get(state, "#000000"),
+            # Orange ring while transcription can't keep up
+            outline="#ff8800" if self.is_overloaded else "black",
+            width=3 if self.is_overloaded else 1,
         )
 
+    def set_overload_status(self, state: bool):
+        self.is_overloaded = state
+        self.set_recording_status(self.recording_state)
+
     def toggle_tts(self):
         self.ui_update_q.put({"toggle_tts": {}})
 
@@ -1,8 +1,8 @@
+import queue
 import time
 from threading import Thread
 
 import torch.multiprocessing as mp
-from transformers import pipeline
 from transformers.models.fnet.tokenization_fnet import Dict
 
 from iris.data_types import (
@@ -14,6 +14,9 @@ from iris.data_types import (
     TTSMsg,
 )
 from iris.gui import UserInterface
+from iris.model_registry import configure_registry, get_pipeline, registry
+from iris.profiles import get_profile
+from iris.translation_cache import TranslationCache
 from iris.workers import AudioWorker, TTSWorker, VADWorker, WhisperWorker
 
 
@@ -40,10 +43,22 @@ class MainThread(Thread):
         self.ui = ui
         self.tts_q = tts_q
 
-        self.sub_translation = pipeline(
+        settings = self.args.settings
+        self.sub_translation_model = (
+            f"Helsinki-NLP/opus-mt-{settings.external_lang}-{settings.user_lang}"
+        )
+        self.precision = get_profile(
+            settings.performance_profile, settings.translation_device
+        ).translation_precision
+        registry.warmup(
             "translation",
-            model=f"Helsinki-NLP/opus-mt-{self.args.settings.external_lang}-{self.args.settings.user_lang}",
-            device=self.args.settings.translation_device,
+            self.sub_translation_model,
+            settings.translation_device,
+            self.precision,
+        )
+        self.translation_cache = TranslationCache(
+            max_size=self.args.settings.translation_cache_size,
+            path=self.args.settings.translation_cache_path,
         )
 
     def set_tts_status(self, state):
@@ -60,23 +75,39 @@ class MainThread(Thread):
     def set_recording_state(self, state: RecorderState):
         self.ui.set_recording_status(state)
 
+    def set_overload_state(self, state: bool):
+        self.ui.set_overload_status(state)
+
     def add_transcription(self, msg: TranscriptionMsg):
         if not msg.text:
             return
         print(msg)
 
         if msg.msg_lang != self.args.settings.user_lang:
-            text = self.sub_translation(msg.text)[0]["translation_text"]
+            lang_key = (msg.msg_lang, self.args.settings.user_lang)
+            text = self.translation_cache.get(msg.text, *lang_key)
+            if text is None:
+                sub_translation = get_pipeline(
+                    "translation",
+                    self.sub_translation_model,
+                    self.args.settings.translation_device,
+                    self.precision,
+                )
+                text = sub_translation(msg.text)[0]["translation_text"]
+                self.translation_cache.put(msg.text, *lang_key, text)
         else:
             text = msg.text
         self.ui.add_subtitles("- " + msg.text)
 
         if msg.channel == OutputChannel.TTS:
-            self.tts_q.put(
-                TTSMsg(
-                    text=msg.text,
+            try:
+                self.tts_q.put_nowait(
+                    TTSMsg(
+                        text=msg.text,
+                    )
                 )
-            )
+            except queue.Full:
+                print("TTS queue full, skipping: ", msg.text)
 
     def run(self):
         msg: dict
@@ -85,6 +116,9 @@ class MainThread(Thread):
             for k, v in msg.items():
                 getattr(self, k)(**v)
 
+        # main() sends None on the way out
+        self.translation_cache.save()
+
 
 def main():
     print("Starting")
@@ -97,15 +131,17 @@ def main():
         model_path="base",
         silero_threshold=0.5,
     )
+    configure_registry(settings)
 
     audio_out_q = mp.Queue()
-    to_transcribe_q = mp.Queue()
-    tts_q = mp.Queue()
+    to_transcribe_q = mp.Queue(maxsize=settings.transcribe_queue_size)
+    tts_q = mp.Queue(maxsize=settings.tts_queue_size)
     ui_update_q = mp.Queue()
 
     args = ProcessArgs(settings, ui_update_q)
 
     ui = UserInterface(ui_update_q)
+    main_thread = None
 
     try:
         print("Initializing Workers")
@@ -137,7 +173,8 @@ def main():
         ):
             time.sleep(1)
 
-        MainThread(args, [], ui_update_q, ui, tts_q).start()
+        main_thread = MainThread(args, [], ui_update_q, ui, tts_q)
+        main_thread.start()
 
         print("Ready")
 
@@ -147,6 +184,9 @@ def main():
         pass
     finally:
         args.shutdown_event.set()
+        if main_thread:
+            ui_update_q.put(None)
+            main_thread.join(timeout=10)
         audio_out_q.close()
         to_transcribe_q.close()
         ui_update_q.close()
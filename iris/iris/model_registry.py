@@ -0,0 +1,199 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Optional
+
+import torch
+from transformers import pipeline
+
+from iris.ct2_translation import CT2TranslationPipeline
+
+PipelineKey = tuple[str, str, str, str]
+
+
+class ModelRegistry:
+    """
+    Process wide cache of transformers pipelines, keyed by (task, model, device,
+    precision). See iris.profiles for the precisions.
+    Each one is loaded the first time it's asked for and shared by every caller
+    after that. Pipelines nobody has asked for in idle_seconds are dropped, and so
+    are the least recently used ones while the loaded weights are over
+    memory_budget_mb. That's checked on every get() and whenever evict_idle() is
+    called, which long running processes should do periodically.
+
+    Dropping a pipeline only removes the registry's reference to it, so callers
+    should ask for it each time they need it rather than holding on to it.
+    """
+
+    def __init__(
+        self, memory_budget_mb: Optional[int] = None, idle_seconds: float = 1800
+    ):
+        self.memory_budget_mb = memory_budget_mb
+        self.idle_seconds = idle_seconds
+        # Options for CT2TranslationPipeline, or None to run translation models
+        # with transformers
+        self.ct2_options: Optional[dict] = None
+
+        # Least recently used first
+        self._pipelines: OrderedDict[PipelineKey, Any] = OrderedDict()
+        self._sizes: dict[PipelineKey, int] = {}
+        self._last_used: dict[PipelineKey, float] = {}
+        self._lock = Lock()
+        # Held while a model loads so that concurrent first callers wait for it
+        # instead of loading their own copy
+        self._load_locks: dict[PipelineKey, Lock] = {}
+
+    def configure(
+        self, memory_budget_mb: Optional[int] = None, idle_seconds: float = 1800
+    ):
+        with self._lock:
+            self.memory_budget_mb = memory_budget_mb
+            self.idle_seconds = idle_seconds
+
+    def configure_translation(
+        self,
+        backend: str = "transformers",
+        ct2_model_dir: str = "ct2_models",
+        inter_threads: int = 1,
+        intra_threads: int = 4,
+    ):
+        """
+        Pick how translation models get run, "transformers" or "ctranslate2". Has
+        to be called before any are loaded.
+        """
+        if backend not in ("transformers", "ctranslate2"):
+            raise ValueError(f"Unknown translation backend {backend}")
+        with self._lock:
+            self.ct2_options = None
+            if backend == "ctranslate2":
+                self.ct2_options = {
+                    "model_dir": ct2_model_dir,
+                    "inter_threads": inter_threads,
+                    "intra_threads": intra_threads,
+                }
+
+    def get(self, task: str, model: str, device: str = "cpu", precision: str = "fp32"):
+        key = (task, model, str(device), precision)
+        with self._lock:
+            if key in self._pipelines:
+                pipe = self._touch(key)
+                self._evict(keep=key)
+                return pipe
+            load_lock = self._load_locks.setdefault(key, Lock())
+
+        with load_lock:
+            with self._lock:
+                if key in self._pipelines:
+                    return self._touch(key)
+
+            print(f"Loading {task} model {model} on {device} as {precision}")
+            if task == "translation" and self.ct2_options is not None:
+                pipe = CT2TranslationPipeline(
+                    model, device=device, precision=precision, **self.ct2_options
+                )
+            else:
+                pipe = load_pipeline(task, model, device, precision)
+
+            with self._lock:
+                self._pipelines[key] = pipe
+                self._sizes[key] = model_size(pipe)
+                self._touch(key)
+                self._evict(keep=key)
+            return pipe
+
+    def warmup(
+        self,
+        task: str,
+        model: str,
+        device: str = "cpu",
+        precision: str = "fp32",
+        example: Any = "Hello",
+    ):
+        """Load a pipeline ahead of time and run it once"""
+        pipe = self.get(task, model, device, precision)
+        if example is not None:
+            pipe(example)
+
+    def loaded(self) -> dict[PipelineKey, int]:
+        """Loaded pipelines and their size in bytes"""
+        with self._lock:
+            return dict(self._sizes)
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict()
+
+    def unload(self, task: str, model: str):
+        """Drop a model now, whatever device and precision it was loaded with"""
+        with self._lock:
+            for key in list(self._pipelines):
+                if key[:2] == (task, model):
+                    self._drop(key)
+
+    def _touch(self, key: PipelineKey):
+        self._pipelines.move_to_end(key)
+        self._last_used[key] = time.monotonic()
+        return self._pipelines[key]
+
+    def _evict(self, keep: Optional[PipelineKey] = None):
+        now = time.monotonic()
+        for key in list(self._pipelines):
+            if key != keep and now - self._last_used[key] > self.idle_seconds:
+                self._drop(key)
+
+        if self.memory_budget_mb is None:
+            return
+        budget = self.memory_budget_mb * 1024 * 1024
+        for key in list(self._pipelines):
+            if sum(self._sizes.values()) <= budget:
+                break
+            if key != keep:
+                self._drop(key)
+
+    def _drop(self, key: PipelineKey):
+        print(f"Unloading {key[0]} model {key[1]}")
+        del self._pipelines[key]
+        del self._sizes[key]
+        del self._last_used[key]
+
+
+def load_pipeline(task: str, model: str, device: str, precision: str):
+    if precision == "bf16":
+        return pipeline(task, model=model, device=device, torch_dtype=torch.bfloat16)
+
+    pipe = pipeline(task, model=model, device=device)
+    if precision == "int8":
+        pipe.model = torch.quantization.quantize_dynamic(
+            pipe.model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return pipe
+
+
+def model_size(pipe) -> int:
+    if isinstance(pipe, CT2TranslationPipeline):
+        return pipe.nbytes
+    try:
+        return sum(p.numel() * p.element_size() for p in pipe.model.parameters())
+    except AttributeError:
+        return 0
+
+
+registry = ModelRegistry()
+
+
+def configure_registry(settings):
+    """
+    Apply the model options from either the server's or the desktop app's
+    Settings to this process's registry
+    """
+    registry.configure(settings.model_memory_budget_mb, settings.model_idle_seconds)
+    registry.configure_translation(
+        settings.translation_backend,
+        settings.translation_ct2_dir,
+        settings.translation_inter_threads,
+        settings.translation_intra_threads,
+    )
+
+
+def get_pipeline(task: str, model: str, device: str = "cpu", precision: str = "fp32"):
+    return registry.get(task, model, device, precision)
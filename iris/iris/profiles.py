@@ -0,0 +1,60 @@
+from dataclasses import dataclass
+
+import ctranslate2
+import torch
+
+
+@dataclass(frozen=True)
+class Profile:
+    """
+    Precision settings for the models, picked by name with Settings.performance_profile
+    in both the desktop app and the server.
+
+    whisper_compute_type is passed straight to CTranslate2. translation_precision
+    is how the transformers translation and TTS models get loaded: "fp32", "int8"
+    (dynamic quantization of the linear layers, CPU only) or "bf16".
+    """
+
+    whisper_compute_type: str = "default"
+    translation_precision: str = "fp32"
+
+
+PROFILES = {
+    "default": Profile(),
+    "int8": Profile(whisper_compute_type="int8", translation_precision="int8"),
+    "bf16": Profile(whisper_compute_type="bfloat16", translation_precision="bf16"),
+}
+
+
+def get_profile(name: str, device: str = "cpu") -> Profile:
+    """
+    The named profile, with whatever the device can't run swapped for the closest
+    thing it can
+    """
+    if name not in PROFILES:
+        raise ValueError(f"Unknown performance profile {name}, use {list(PROFILES)}")
+    profile = PROFILES[name]
+
+    ct2_device = "cuda" if str(device).startswith("cuda") else "cpu"
+    supported = ctranslate2.get_supported_compute_types(ct2_device)
+    compute_type = profile.whisper_compute_type
+    if compute_type != "default" and compute_type not in supported:
+        print(f"{compute_type} isn't supported on {ct2_device}, using float32")
+        compute_type = "float32"
+
+    precision = profile.translation_precision
+    if precision == "int8" and ct2_device != "cpu":
+        # Dynamic quantization only has CPU kernels
+        precision = "fp32"
+    if precision == "bf16" and not bf16_supported(ct2_device):
+        precision = "fp32"
+
+    return Profile(whisper_compute_type=compute_type, translation_precision=precision)
+
+
+def bf16_supported(device: str) -> bool:
+    if device == "cuda":
+        return torch.cuda.is_bf16_supported()
+    # Without AVX512-BF16 or AMX, torch emulates bf16 and ends up slower than fp32
+    is_supported = getattr(torch.cpu, "_is_avx512_bf16_supported", None)
+    return bool(is_supported and is_supported())
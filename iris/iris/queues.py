@@ -0,0 +1,32 @@
+import queue
+import time
+from typing import Optional
+
+
+def drain(
+    q, max_items: int, max_wait: float, timeout: Optional[float] = None
+) -> tuple[list, bool]:
+    """
+    Block until one item is available, then keep taking whatever else shows up
+    until there are max_items or max_wait seconds have passed. Returns the batch
+    and whether the None shutdown sentinel was seen. Raises queue.Empty if nothing
+    arrives within timeout.
+    """
+    item = q.get(timeout=timeout)
+    if item is None:
+        return [], True
+
+    batch = [item]
+    deadline = time.monotonic() + max_wait
+    while len(batch) < max_items:
+        timeout = deadline - time.monotonic()
+        try:
+            item = q.get(timeout=timeout) if timeout > 0 else q.get_nowait()
+        except queue.Empty:
+            break
+
+        if item is None:
+            return batch, True
+        batch.append(item)
+
+    return batch, False
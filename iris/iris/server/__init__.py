@@ -1,9 +1,16 @@
 from uuid import uuid4
+import asyncio
 import os
+import time
+from collections import deque
 from fastapi import WebSocket
 from pydantic import BaseModel
+from starlette.websockets import WebSocketState
 from torch import multiprocessing as mp
-from typing import Optional
+from typing import Any, Optional
+
+from iris.server.encoding import Encoding, encode, supported
+from iris.server.metrics import stage_latency
 
 
 class Settings(BaseModel):
@@ -16,12 +23,57 @@ class Settings(BaseModel):
     ]
     static_root: str = "./ui/build"
     whisper_model: str = "base"
+    # Model precision, one of iris.profiles.PROFILES
+    performance_profile: str = "default"
+    # Smaller model used instead of whisper_model while transcription is backed up
+    whisper_fast_model: Optional[str] = None
+    # Clips waiting at which everything goes to the fast model
+    tier_queue_depth: int = 8
+    # Clips longer than this go to the fast model whenever anything is waiting
+    tier_long_clip_seconds: float = 20
     ssl_keyfile: Optional[str] = "./dev/certs/key.pem"
     ssl_certfile: Optional[str] = "./dev/certs/cert.pem"
     translation_device: str = "cpu"
+    translation_cache_size: int = 2048
+    translation_cache_path: Optional[str] = None
+    # "transformers", or "ctranslate2" to convert the translation models on first
+    # use and run them with CTranslate2
+    translation_backend: str = "transformers"
+    translation_ct2_dir: str = "ct2_models"
+    translation_inter_threads: int = 1
+    translation_intra_threads: int = 4
+    # Translation models are unloaded when unused for model_idle_seconds, or least
+    # recently used first to stay under model_memory_budget_mb
+    model_memory_budget_mb: Optional[int] = None
+    model_idle_seconds: float = 1800
     whisper_device: str = "cpu"
+    whisper_cpu_threads: int = 1
+    transcriber_workers: int = 1
+    transcribe_batch_size: int = 8
+    transcribe_batch_wait_ms: int = 50
+    # How long a user's results wait on a clip that went missing before skipping it
+    reorder_timeout_seconds: float = 30
+    audio_slab_count: int = 16
+    audio_queue_size: int = 64
+    whisper_out_queue_size: int = 256
+    # New clips are flagged, and partials skipped, past this estimated wait
+    overload_wait_seconds: float = 5.0
+    # Clips are handed to the transcribers in audio_slab_count shared memory slabs
+    # of audio_slab_seconds each, 64 KB a second, so about 31 MB of /dev/shm by
+    # default. Docker only gives containers 64 MB, raise it with --shm-size before
+    # raising these. Longer clips go through the queue instead.
+    audio_slab_seconds: int = 30
     auto_code_reload: bool = True
     http_port: int = 8000
+    token_cache_ttl: int = 300
+    persist_fsync_interval: float = 1.0
+    # "opus" or "wav"
+    audio_archive_format: str = "opus"
+    broker_queue_size: int = 32
+    stream_workers: int = 4
+    stream_queue_size: int = 64
+    # How often to send provisional transcripts while someone is talking, 0 is off
+    partial_interval_ms: int = 0
 
     @classmethod
     def load(cls):
@@ -42,42 +94,131 @@ class Settings(BaseModel):
         return cls(**kwargs)
 
 
-# This is kind of an abomination, but I don't know what else to do. If the websocket isn't
-# running on the same process (or maybe even the same thread) as the instance of this class,
-# it will absolutely break.
+class SocketChannel:
+    """
+    Outgoing queue and writer task for one websocket. Everything here runs on the
+    event loop the socket was accepted on.
+    """
+
+    def __init__(self, socket: WebSocket, max_size: int, encoding: Encoding):
+        self.socket = socket
+        self.encoding = encoding
+        self.loop = asyncio.get_running_loop()
+        self.max_size = max_size
+        # (key, data, time it was queued)
+        self.queue: deque[tuple[Optional[str], Any, float]] = deque()
+        self.ready = asyncio.Event()
+        # Messages dropped since the last successful send
+        self.dropped = 0
+        self.closed = False
+        self.task = self.loop.create_task(self.writer())
+
+    def put(self, data, key: Optional[str] = None, queued_at: float = 0):
+        if self.closed:
+            return
+
+        # A newer version of a message that hasn't gone out yet replaces the old one
+        if key is not None:
+            for i, (queued_key, _, _) in enumerate(self.queue):
+                if queued_key == key:
+                    self.queue[i] = (key, data, queued_at)
+                    return
+
+        if len(self.queue) >= self.max_size:
+            self.queue.popleft()
+            self.dropped += 1
+            if self.dropped > self.max_size:
+                print("Dropping slow socket")
+                self.close()
+                return
+
+        self.queue.append((key, data, queued_at))
+        self.ready.set()
+
+    async def writer(self):
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.queue:
+                    _, data, queued_at = self.queue.popleft()
+                    if isinstance(data, bytes):
+                        await self.socket.send_bytes(data)
+                    else:
+                        await self.socket.send_text(data)
+                    self.dropped = 0
+                    # Only broker messages are timed
+                    if queued_at:
+                        stage_latency.observe("broadcast", time.time() - queued_at)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print("Socket send failed: ", e)
+        finally:
+            self.closed = True
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self.task.cancel()
+        if self.socket.application_state != WebSocketState.DISCONNECTED:
+            self.loop.create_task(self.socket.close())
+
+    @property
+    def is_alive(self) -> bool:
+        return not self.closed and (
+            self.socket.client_state != WebSocketState.DISCONNECTED
+            and self.socket.application_state != WebSocketState.DISCONNECTED
+        )
+
+
+# Sockets belong to the event loop they were accepted on, so messages are handed to
+# each socket's writer task on that loop rather than sent from the caller's thread.
 class MessageBroker:
-    def __init__(self):
-        self.sockets: dict[str, WebSocket] = {}
+    def __init__(self, queue_size: int = 32):
+        self.queue_size = queue_size
+        self.sockets: dict[str, SocketChannel] = {}
 
-    def register(self, socket):
+    def register(self, socket, encoding: Encoding = Encoding.JSON):
+        if not supported(encoding):
+            print(f"{encoding.value} is not installed, falling back to json")
+            encoding = Encoding.JSON
         id = str(uuid4())
-        self.sockets[id] = socket
+        self.sockets[id] = SocketChannel(socket, self.queue_size, encoding)
         return id
 
     def remove(self, id):
-        if id in self.sockets:
-            del self.sockets[id]
+        if channel := self.sockets.pop(id, None):
+            channel.loop.call_soon_threadsafe(channel.close)
 
     async def reap(
         self,
     ):
-        # TODO: loop through the current sockets and remove any closed ones
-        pass
-
-    async def send(self, data):
-        # TODO: do this with asyncio.gather
-        to_del = []
-        for k, sock in self.sockets.items():
-            try:
-                await sock.send_text(data)
-            except:
+        for k, channel in list(self.sockets.items()):
+            if not channel.is_alive:
                 print("Removing socket ", k)
-                to_del.append(k)
-        for k in to_del:
-            self.remove(k)
+                self.remove(k)
+
+    async def send(self, msg: BaseModel, key: Optional[str] = None):
+        """
+        Queue msg for every socket without waiting for it to be sent. It is encoded
+        once per encoding in use and the result is shared by all sockets. Messages
+        with the same key replace each other if they are still waiting in a queue.
+        """
+        await self.reap()
+        channels = list(self.sockets.values())
+        encoded = {c.encoding: None for c in channels}
+        for encoding in encoded:
+            encoded[encoding] = encode(msg, encoding)
+
+        queued_at = time.time()
+        for channel in channels:
+            channel.loop.call_soon_threadsafe(
+                channel.put, encoded[channel.encoding], key, queued_at
+            )
 
 
-translated_broker = MessageBroker()
-audio_in_q = mp.Queue()
-whisper_out_q = mp.Queue()
 settings = Settings.load()
+translated_broker = MessageBroker(settings.broker_queue_size)
+audio_in_q = mp.Queue(maxsize=settings.audio_queue_size)
+whisper_out_q = mp.Queue(maxsize=settings.whisper_out_queue_size)
@@ -1,12 +1,28 @@
+import asyncio
+import queue
 import secrets
 from typing import Optional
 
-from fastapi import BackgroundTasks, Depends, FastAPI, WebSocket
+from fastapi import (
+    BackgroundTasks,
+    Depends,
+    FastAPI,
+    HTTPException,
+    Request,
+    Response,
+    WebSocket,
+    status,
+)
+from fastapi.responses import StreamingResponse
 from pydantic.types import UUID4
 
 from iris.server import translated_broker, whisper_out_q
+from iris.server.audio_archive import find_audio, read_chunks
 from iris.server.auth import get_current_user, is_admin
-from iris.server.models import CorrectedMessage, Message, TokenResp, User
+from iris.server.encoding import Encoding
+from iris.server.models import CorrectedMessage, Message, Role, TokenResp, User
+from iris.server.persistence import get_writer
+from iris.server.recent import recent_messages
 from iris.server.websocket_stream import receive_stream
 
 api = FastAPI(dependencies=[Depends(get_current_user)])
@@ -21,13 +37,41 @@ async def correct_message(
     update_text: CorrectedMessage,
 ):
     m = Message.load_from_file(user, id)
+    if m is None:
+        # The message can reach the client before the writer has stored it
+        await asyncio.to_thread(get_writer().flush, 5)
+        m = Message.load_from_file(user, id)
+    if m is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
     if not m.original_text:
         m.original_text = m.text
     m.text = update_text.corrected_text
 
-    whisper_out_q.put(m)
+    # Blocking on a full queue would stall the whole event loop
+    try:
+        whisper_out_q.put_nowait(m)
+    except queue.Full:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, try again",
+        )
+
 
-    m.save_to_file()
+@api.get("/messages/{user}/{id}/audio")
+async def message_audio(
+    id: UUID4, user: str, current_user: User = Depends(get_current_user)
+):
+    if current_user.name != user and current_user.role != Role.ADMIN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+
+    m = Message(id=id, user=user, text="", language="")
+    audio = find_audio(m.audio_path())
+    if not audio:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    path, media_type = audio
+    return StreamingResponse(read_chunks(path), media_type=media_type)
 
 
 @api.get("/users", dependencies=[Depends(is_admin)])
@@ -59,22 +103,30 @@ async def user_create_token(name: str) -> TokenResp:
     return TokenResp(auth_code=code)
 
 
-@api.get("/recent-messages")
-async def get_recent_messages() -> list[Message]:
-    return Message.get_last_messages(10)[::-1]
+@api.get("/recent-messages", response_model=list[Message])
+async def get_recent_messages(request: Request):
+    body, etag = recent_messages.response()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
 
 
 @api.delete("/recent-messages", dependencies=[Depends(is_admin)])
 async def clear_recent_messages():
     Message.clear_last_messages()
+    recent_messages.clear()
 
 
 @api.websocket("/ws-whisper")
-async def whisper(websocket: WebSocket, current_user: User = Depends(get_current_user)):
+async def whisper(
+    websocket: WebSocket,
+    encoding: Encoding = Encoding.JSON,
+    current_user: User = Depends(get_current_user),
+):
     await websocket.accept()
-    id = translated_broker.register(websocket)
+    id = translated_broker.register(websocket, encoding)
     try:
-        await receive_stream(websocket, current_user)
+        await receive_stream(websocket, current_user, translated_broker.sockets[id])
     # to handle the RuntimeError: Cannot call "receive" once a disconnect message has been received. error
     except RuntimeError:
         pass
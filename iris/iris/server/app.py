@@ -1,25 +1,61 @@
+import asyncio
 from contextlib import asynccontextmanager
 import uvicorn
-from fastapi import FastAPI, HTTPException, Response
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from torch import multiprocessing as mp
 from datetime import datetime, timedelta, timezone
 
+from iris.model_registry import configure_registry, registry
 from iris.server import audio_in_q, settings, translated_broker, whisper_out_q
 from iris.server.api import api, auth_codes
 from iris.server.auth import create_token
-from iris.server.models import User, Languages, I18NConfig
-from iris.server.workers import BrokerThread, whisper_process
+from iris.server.i18n_bundles import i18n_bundles
+from iris.server.metrics import render as render_metrics
+from iris.server.models import User, Languages, Message
+from iris.server.persistence import get_writer
+from iris.server.recent import recent_messages
+from iris.server.shared_audio import get_slab_pool
+from iris.server.vad import vad_scheduler
+from iris.server.workers import BrokerThread, TranscriberPool
+from iris.vad_model import get_vad_model
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    BrokerThread(whisper_out_q, translated_broker).start()
-    mp.Process(target=whisper_process, args=[audio_in_q, whisper_out_q]).start()
+    get_vad_model()
+    configure_registry(settings)
+    i18n_bundles.build([settings.base_language, *settings.supported_languages])
+    recent_messages.load(Message.get_last_messages(recent_messages.max_size)[::-1])
+    vad_scheduler.start()
+    broker = BrokerThread(whisper_out_q, translated_broker)
+    broker.start()
+    slabs = get_slab_pool()
+    transcriber_pool = TranscriberPool(
+        audio_in_q,
+        whisper_out_q,
+        slabs,
+        settings.transcriber_workers,
+        reorder_timeout=settings.reorder_timeout_seconds,
+    )
+    transcriber_pool.start()
+    evictor = asyncio.create_task(evict_idle_models())
     yield
-    audio_in_q.put(None)
+    evictor.cancel()
+    # No new clips from here on, then let the transcribers finish what's queued
+    vad_scheduler.stop()
+    await asyncio.to_thread(transcriber_pool.stop)
     whisper_out_q.put(None)
+    broker.join(timeout=10)
+    get_writer().stop(timeout=10)
+    slabs.close()
+
+
+async def evict_idle_models():
+    while True:
+        await asyncio.sleep(60)
+        registry.evict_idle()
 
 
 app = FastAPI(
@@ -70,12 +106,21 @@ async def logout(response: Response):
     response.delete_cookie("session_token")
 
 
-@app.get("/translations/{language}")
-async def get_translations(language) -> I18NConfig:
-    if language in settings.supported_languages or language == settings.base_language:
-        return I18NConfig.load_language(language)
+@app.get("/metrics")
+async def get_metrics():
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4")
+
 
-    raise HTTPException(status_code=400, detail="Language not supported")
+@app.get("/translations/{language}")
+async def get_translations(language, request: Request):
+    try:
+        body, etag = i18n_bundles.response(language)
+    except KeyError:
+        raise HTTPException(status_code=400, detail="Language not supported")
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
 
 
 app.mount(
@@ -0,0 +1,48 @@
+import os
+from typing import Iterator, Optional
+
+import numpy as np
+import pyogg
+
+SAMPLE_RATE = 16000
+# Opus frame length in milliseconds, the same as the browser recorder uses
+OPUS_FRAME_MS = 20
+READ_CHUNK_BYTES = 64 * 1024
+
+MEDIA_TYPES = {
+    "opus": "audio/ogg",
+    "wav": "audio/wav",
+}
+
+
+def write_opus(path: str, pcm: np.ndarray):
+    """Encode 16 kHz mono int16 audio into an Ogg/Opus file"""
+    encoder = pyogg.OpusBufferedEncoder()
+    encoder.set_application("voip")
+    encoder.set_sampling_frequency(SAMPLE_RATE)
+    encoder.set_channels(1)
+    encoder.set_frame_size(OPUS_FRAME_MS)
+
+    writer = pyogg.OggOpusWriter(path, encoder)
+    try:
+        writer.write(memoryview(bytearray(pcm.tobytes())))
+    finally:
+        writer.close()
+
+
+def find_audio(base_path: str) -> Optional[tuple[str, str]]:
+    """
+    Returns the path and media type of the archived audio for base_path, which is
+    the audio path without an extension. Older messages were archived as WAV.
+    """
+    for ext, media_type in MEDIA_TYPES.items():
+        path = f"{base_path}.{ext}"
+        if os.path.exists(path):
+            return path, media_type
+    return None
+
+
+def read_chunks(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while chunk := f.read(READ_CHUNK_BYTES):
+            yield chunk
@@ -1,11 +1,17 @@
+import time
 from typing import Optional
 
 import jwt
 from fastapi import Depends, Cookie, HTTPException, status
 
 
+from iris.server import settings
 from iris.server.models import User, Role
 
+# session token -> (user name, secret it was verified with, expiry)
+_verified_tokens: dict[str, tuple[str, str, float]] = {}
+MAX_VERIFIED_TOKENS = 4096
+
 
 def create_token(user: User) -> str:
     return jwt.encode(
@@ -23,6 +29,16 @@ async def get_current_user(session_token: Optional[str] = Cookie(None)) -> User:
     )
     if not session_token:
         raise credentials_exception
+
+    now = time.monotonic()
+    if cached := _verified_tokens.get(session_token):
+        username, secret, expires = cached
+        u = User.load_from_file(username)
+        # A rotated secret invalidates the token straight away
+        if expires > now and u.secret_key.get_secret_value() == secret:
+            return u
+        _verified_tokens.pop(session_token, None)
+
     try:
         username = jwt.decode(session_token, options={"verify_signature": False}).get(
             "name"
@@ -31,10 +47,17 @@ async def get_current_user(session_token: Optional[str] = Cookie(None)) -> User:
         jwt.decode(
             session_token, key=u.secret_key.get_secret_value(), algorithms=["HS256"]
         )
-        return u
     except jwt.exceptions.PyJWTError as e:
         raise credentials_exception
-    return User(username=username)
+
+    if len(_verified_tokens) >= MAX_VERIFIED_TOKENS:
+        _verified_tokens.clear()
+    _verified_tokens[session_token] = (
+        username,
+        u.secret_key.get_secret_value(),
+        now + settings.token_cache_ttl,
+    )
+    return u
 
 
 async def is_admin(current_user: User = Depends(get_current_user)):
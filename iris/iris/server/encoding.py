@@ -0,0 +1,39 @@
+from enum import Enum
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Encoding(str, Enum):
+    # Text frames, what older clients expect
+    JSON = "json"
+    # The same JSON in binary frames, so one bytes object can go to every socket
+    JSON_BINARY = "json-binary"
+    MSGPACK = "msgpack"
+
+
+def supported(encoding: Encoding) -> bool:
+    return encoding != Encoding.MSGPACK or msgpack is not None
+
+
+def encode(msg: BaseModel, encoding: Encoding) -> str | bytes:
+    if encoding == Encoding.MSGPACK:
+        return msgpack.packb(msg.model_dump(mode="json"))
+
+    if orjson:
+        data = orjson.dumps(msg.model_dump())
+    else:
+        data = msg.model_dump_json().encode()
+
+    if encoding == Encoding.JSON:
+        return data.decode()
+    return data
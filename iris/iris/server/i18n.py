@@ -34,7 +34,8 @@ class I18NMessages:
         "Close",
         "Clear",
         "edited",
-        "Refresh"
+        "Refresh",
+        "The server is busy, your message was not sent. Please try again."
     ]
 
     @classmethod
@@ -0,0 +1,35 @@
+import hashlib
+from threading import Lock
+
+from iris.server.models import I18NConfig
+
+
+class I18NBundles:
+    """
+    The UI strings for every supported language, serialized once so
+    /translations/{language} is answered from memory. Bundles are loaded, or
+    translated if they're out of date, by build() at startup, never on a request.
+    """
+
+    def __init__(self):
+        self._bundles: dict[str, tuple[bytes, str]] = {}
+        self._lock = Lock()
+
+    def build(self, languages: list[str]):
+        for language in dict.fromkeys(languages):
+            print(f"Loading UI translations for {language}")
+            self.add(I18NConfig.load_language(language))
+
+    def add(self, config: I18NConfig):
+        body = config.model_dump_json().encode()
+        digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+        with self._lock:
+            self._bundles[config.language] = (body, f'"{digest}"')
+
+    def response(self, language: str) -> tuple[bytes, str]:
+        """The bundle's JSON and its ETag. Raises KeyError if it wasn't built."""
+        with self._lock:
+            return self._bundles[language]
+
+
+i18n_bundles = I18NBundles()
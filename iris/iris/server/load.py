@@ -0,0 +1,32 @@
+import math
+
+from iris.server import audio_in_q, settings, whisper_out_q
+from iris.server.metrics import load, queue_depth, stage_latency
+
+
+def depth(q) -> int:
+    try:
+        return q.qsize()
+    except NotImplementedError:
+        # Not available on macOS
+        return 0
+
+
+def estimated_wait() -> float:
+    """
+    Rough number of seconds a new clip will wait before a transcriber picks it up,
+    based on the queue depth and how long recent batches took.
+    """
+    per_batch = stage_latency.quantiles("whisper").get(0.5, 0)
+    per_round = settings.transcriber_workers * settings.transcribe_batch_size
+    return math.ceil(depth(audio_in_q) / per_round) * per_batch
+
+
+def is_overloaded() -> bool:
+    return estimated_wait() > settings.overload_wait_seconds
+
+
+queue_depth.set_function("audio_in", lambda: depth(audio_in_q))
+queue_depth.set_function("whisper_out", lambda: depth(whisper_out_q))
+load.set_function("estimated_wait_seconds", estimated_wait)
+load.set_function("overloaded", is_overloaded)
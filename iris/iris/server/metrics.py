@@ -0,0 +1,145 @@
+import time
+from collections import defaultdict, deque
+from threading import Lock
+from typing import Callable, Optional
+
+import numpy as np
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """
+    Prometheus histogram split by one label. A window of recent observations is kept
+    as well so p50/p95/p99 can be read without a Prometheus server.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label: str,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        window: int = 1024,
+    ):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+
+        self._counts: dict[str, list[int]] = defaultdict(lambda: [0] * len(buckets))
+        self._sum: dict[str, float] = defaultdict(float)
+        self._total: dict[str, int] = defaultdict(int)
+        self._recent: dict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=window)
+        )
+        self._lock = Lock()
+
+    def observe(self, label_value: str, value: float):
+        with self._lock:
+            counts = self._counts[label_value]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sum[label_value] += value
+            self._total[label_value] += 1
+            self._recent[label_value].append(value)
+
+    def quantiles(self, label_value: str) -> dict[float, float]:
+        with self._lock:
+            recent = list(self._recent.get(label_value, ()))
+        if not recent:
+            return {}
+        return dict(zip(QUANTILES, np.quantile(recent, QUANTILES).tolist()))
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} histogram",
+        ]
+        recent = [
+            f"# HELP {self.name}_recent {self.help}, over recent observations",
+            f"# TYPE {self.name}_recent summary",
+        ]
+        with self._lock:
+            label_values = list(self._total)
+
+        for value in label_values:
+            with self._lock:
+                counts = list(self._counts[value])
+                total = self._total[value]
+                sum_ = self._sum[value]
+
+            label = f'{self.label}="{value}"'
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {total}')
+            lines.append(f"{self.name}_sum{{{label}}} {sum_}")
+            lines.append(f"{self.name}_count{{{label}}} {total}")
+
+            for q, v in self.quantiles(value).items():
+                recent.append(f'{self.name}_recent{{{label},quantile="{q}"}} {v}')
+
+        return lines + recent
+
+
+class Gauge:
+    """Prometheus gauge split by one label, read from a callback when rendered"""
+
+    def __init__(self, name: str, help: str, label: str):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._readers: dict[str, Callable[[], float]] = {}
+
+    def set_function(self, label_value: str, fn: Callable[[], float]):
+        self._readers[label_value] = fn
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+        ]
+        for value, fn in list(self._readers.items()):
+            lines.append(f'{self.name}{{{self.label}="{value}"}} {float(fn())}')
+        return lines
+
+
+stage_latency = Histogram(
+    "iris_stage_latency_seconds",
+    "Time spent in each stage from the end of speech to broadcast",
+    "stage",
+)
+
+
+def observe_stage(
+    stage: str, timings: dict[str, float], start: str, end: Optional[str] = None
+):
+    """
+    Record the time between two of a message's timestamps, or from start until now
+    if end isn't given. Messages that didn't go through both stages, like
+    corrections, are skipped.
+    """
+    if start not in timings or (end and end not in timings):
+        return
+    end_time = timings[end] if end else time.time()
+    stage_latency.observe(stage, end_time - timings[start])
+
+
+queue_depth = Gauge(
+    "iris_queue_depth", "Number of items waiting in each pipeline queue", "queue"
+)
+load = Gauge("iris_load", "Estimated transcription wait and overload state", "kind")
+translation_cache = Gauge(
+    "iris_translation_cache",
+    "Translation cache size, and hits and misses since startup",
+    "stat",
+)
+
+
+def render() -> str:
+    lines = []
+    for family in (stage_latency, queue_depth, load, translation_cache):
+        lines.extend(family.render())
+    return "\n".join(lines) + "\n"
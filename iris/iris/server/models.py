@@ -11,11 +11,16 @@ import numpy as np
 from pydantic import BaseModel, Field, SecretStr
 from pydantic.types import UUID4
 from collections import OrderedDict
+from threading import Lock
 
 from iris.server import settings
+from iris.server.audio_archive import write_opus
 from iris.server.i18n import I18NMessages
+from iris.server.shared_audio import AudioRef
+from iris.server.storage import MessageStore
 
-from transformers import pipeline
+from iris.model_registry import get_pipeline, registry
+from iris.profiles import get_profile
 from transformers.models.speech_to_text.tokenization_speech_to_text import LANGUAGES
 
 
@@ -37,6 +42,19 @@ class StreamMode(str, Enum):
 
 MESSAGE_DIR = settings.data_path
 
+message_store = MessageStore(os.path.join(MESSAGE_DIR, "messages.db"))
+
+
+def log_day() -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+# Users are read on every authenticated request, so they're kept in memory once
+# loaded. save_to_file keeps this up to date.
+_users: dict[str, "User"] = {}
+_user_names: Optional[list[str]] = None
+_users_lock = Lock()
+
 
 def get_top_level_dirs(path):
     return [d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d))]
@@ -58,15 +76,23 @@ class User(BaseModel):
 
     @classmethod
     def all(cls) -> list[Self]:
-        users = []
-        for dir in get_top_level_dirs(os.path.join(MESSAGE_DIR, "users")):
-            users.append(cls.load_from_file(dir))
-        return users
+        global _user_names
+        with _users_lock:
+            if _user_names is None:
+                _user_names = get_top_level_dirs(os.path.join(MESSAGE_DIR, "users"))
+            names = list(_user_names)
+        return [cls.load_from_file(name) for name in names]
 
     @classmethod
     def load_from_file(cls, name):
+        if (u := _users.get(name)) is not None:
+            return u
+
         path = os.path.join(MESSAGE_DIR, "users", name, "user_data.json")
-        return cls.parse_file(path)
+        u = cls.parse_file(path)
+        with _users_lock:
+            _users[name] = u
+        return u
 
     def save_to_file(self):
         path = os.path.join(MESSAGE_DIR, "users", self.name, "user_data.json")
@@ -74,6 +100,11 @@ class User(BaseModel):
         with open(path, "w") as f:
             f.write(self.json_internal())
 
+        with _users_lock:
+            _users[self.name] = self
+            if _user_names is not None and self.name not in _user_names:
+                _user_names.append(self.name)
+
 
 class Message(BaseModel):
     text: str
@@ -86,73 +117,63 @@ class Message(BaseModel):
     id: UUID4 = Field(default_factory=lambda: uuid.uuid4())
     timestamp: datetime = Field(default_factory=lambda: datetime.now())
     is_conversation_mode: bool = False
+    # Provisional text for an utterance that is still being recorded
+    is_partial: bool = False
+    # Sent instead of a final when an utterance that had partials came to nothing,
+    # so clients can remove the provisional text
+    is_discarded: bool = False
+    # Whisper model that produced the text
+    model: Optional[str] = None
+    # Stage name -> time.time() when the message got there. Only used for metrics.
+    timings: dict[str, float] = Field(default_factory=dict, exclude=True)
 
     @classmethod
-    def load_from_file(cls, user, id):
-        path = os.path.join(MESSAGE_DIR, "users", user, str(id) + ".json")
-        return cls.parse_file(path)
-
-    def save_to_file(self):
-        path = os.path.join(MESSAGE_DIR, "users", self.user, str(self.id) + ".json")
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w") as f:
-            f.write(self.json())
-
-    def save_audio(self, audio):
-        path = os.path.join(MESSAGE_DIR, "users", self.user, str(self.id) + ".wav")
-        os.makedirs(os.path.dirname(path), exist_ok=True)
+    def load_from_file(cls, user, id) -> Optional[Self]:
+        data = message_store.get(user, str(id))
+        if data is None:
+            # Messages from before the message store was added
+            path = os.path.join(MESSAGE_DIR, "users", user, str(id) + ".json")
+            if not os.path.exists(path):
+                return None
+            return cls.parse_file(path)
+        return cls.model_validate_json(data)
+
+    def audio_path(self) -> str:
+        """Where the message's audio is archived, without the extension"""
+        return os.path.join(MESSAGE_DIR, "users", self.user, str(self.id))
+
+    def write_audio(self, pcm: np.ndarray) -> str:
+        os.makedirs(os.path.dirname(self.audio_path()), exist_ok=True)
+
+        if settings.audio_archive_format == "opus":
+            path = self.audio_path() + ".opus"
+            write_opus(path, pcm)
+            return path
+
+        path = self.audio_path() + ".wav"
         with wave.open(path, "w") as wav_file:
             # Define audio parameters
-            audio = np.int16(audio * 32767)
             wav_file.setnchannels(1)  # Mono
             wav_file.setsampwidth(2)  # Two bytes per sample
             wav_file.setframerate(16000)
 
             # Convert the NumPy array to bytes and write it to the WAV file
-            wav_file.writeframes(audio.tobytes())
-
-    def save_to_log(self):
-        path = os.path.join(
-            MESSAGE_DIR, "log", datetime.now().strftime("%Y-%m-%d") + ".txt"
-        )
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "a") as f:
-            f.write("\n" + self.json())
+            wav_file.writeframes(pcm.tobytes())
+        return path
 
     @classmethod
     def get_last_messages(cls, num_items: int) -> list[Self]:
-        path = os.path.join(
-            MESSAGE_DIR, "log", datetime.now().strftime("%Y-%m-%d") + ".txt"
-        )
-        lines = []
-
-        try:
-            with open(path, "r") as f:
-                lines = f.read().strip("\n").split("\n")
-        except:
-            return []
-
-        if len(lines) >= num_items:
-            export_slice = lines
-        else:
-            export_slice = lines[num_items * -1 :]
-
-        messages = []
-        for msg in export_slice:
-            if msg:
-                messages.append(cls.model_validate_json(msg))
-
-        return messages
+        """
+        The last num_items messages from today's log, oldest first
+        """
+        return [
+            cls.model_validate_json(data)
+            for data in reversed(message_store.last_logged(log_day(), num_items))
+        ]
 
     @staticmethod
     def clear_last_messages():
-        path = os.path.join(
-            MESSAGE_DIR, "log", datetime.now().strftime("%Y-%m-%d") + ".txt"
-        )
-        try:
-            os.remove(path)
-        except FileNotFoundError:
-            return
+        message_store.clear_log(log_day())
 
 
 class CorrectedMessage(BaseModel):
@@ -169,9 +190,21 @@ class StreamMessage(BaseModel):
 
 
 class TranscriptionMessage(BaseModel):
-    audio: Any
-    user: User
+    user: str
+    language: str
     recording_meta: Optional[StreamMessage]
+    # The clip is normally in shared memory and only audio_ref is sent. audio is
+    # used when it doesn't fit, and is filled in from the slab by the transcriber.
+    audio: Any = None
+    audio_ref: Optional[AudioRef] = None
+    # Id for the resulting Message, shared by an utterance's partials and its final
+    message_id: Optional[UUID4] = None
+    is_partial: bool = False
+    # Set on a final if partials for the same utterance were queued before it
+    had_partials: bool = False
+    timings: dict[str, float] = {}
+    # Per user counter so results can be put back in order after transcription
+    seq: int = 0
 
 
 class I18NConfig(BaseModel):
@@ -197,15 +230,26 @@ class I18NConfig(BaseModel):
     def init_lang(cls, language):
         message_dict = OrderedDict()
         if language != Languages.ENGLISH:
-            translation_model = pipeline(
+            model_name = f"Helsinki-NLP/opus-mt-en-{language}"
+            translation_model = get_pipeline(
                 "translation",
-                model=f"Helsinki-NLP/opus-mt-en-{language}",
-                device=settings.translation_device,
+                model_name,
+                settings.translation_device,
+                get_profile(
+                    settings.performance_profile, settings.translation_device
+                ).translation_precision,
             )
 
-            for k in I18NMessages.messages:
-                out = translation_model(k)
-                message_dict[k] = " ".join([m["translation_text"] for m in out])
+            # One call for the whole bundle so the pipeline can batch it
+            out = translation_model(
+                I18NMessages.messages, batch_size=len(I18NMessages.messages)
+            )
+            for k, o in zip(I18NMessages.messages, out):
+                if isinstance(o, dict):
+                    o = [o]
+                message_dict[k] = " ".join([m["translation_text"] for m in o])
+            # Bundles are only built at startup, nothing else needs this model
+            registry.unload("translation", model_name)
         else:
             for k in I18NMessages.messages:
                 message_dict[k] = k
@@ -222,5 +266,9 @@ class I18NConfig(BaseModel):
         path = os.path.join(MESSAGE_DIR, "i18n", self.language + ".json")
         os.makedirs(os.path.dirname(path), exist_ok=True)
 
-        with open(path, "w") as f:
+        # Written next to the old file and swapped in, so a reader never sees a
+        # partial bundle
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
             f.write(self.json())
+        os.replace(tmp_path, path)
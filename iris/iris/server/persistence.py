@@ -0,0 +1,115 @@
+import os
+import queue
+import time
+from threading import Event, Lock, Thread
+from typing import Optional
+
+import numpy as np
+
+from iris.server import settings
+from iris.server.models import Message, log_day, message_store
+from iris.queues import drain
+
+
+class PersistenceWriter(Thread):
+    """
+    Does message, log and audio writes in the background so they stay off the
+    transcription and translation paths. Whatever has queued up is written in one
+    go: message and log rows in a single transaction, audio files one after the
+    other. The database WAL and new audio files are fsynced every fsync_interval
+    seconds.
+    """
+
+    def __init__(self, fsync_interval: float, max_batch: int = 256, **kwargs):
+        super().__init__(daemon=True, **kwargs)
+        self.fsync_interval = fsync_interval
+        self.max_batch = max_batch
+        self.jobs = queue.Queue()
+        self.unsynced: list[str] = []
+        self.last_sync = time.monotonic()
+
+    def save_message(self, m: Message):
+        # Serialized now, the broker keeps changing the message after this
+        row = (str(m.id), m.user, m.timestamp.isoformat(), m.json())
+        self.jobs.put(("message", row))
+
+    def save_log(self, m: Message):
+        self.jobs.put(("log", (log_day(), str(m.id), m.json())))
+
+    def save_audio(self, m: Message, audio: np.ndarray):
+        # Converting makes a copy, so the caller is free to reuse the audio buffer
+        self.jobs.put(("audio", (m, np.int16(audio * 32767))))
+
+    def flush(self, timeout: Optional[float] = None):
+        """Block until everything queued so far has been written and synced"""
+        done = Event()
+        self.jobs.put(("flush", done))
+        done.wait(timeout)
+
+    def stop(self, timeout: Optional[float] = None):
+        self.flush(timeout)
+        self.jobs.put(None)
+
+    def run(self):
+        done = False
+        while not done:
+            try:
+                batch, done = drain(
+                    self.jobs, self.max_batch, 0, timeout=self.fsync_interval
+                )
+            except queue.Empty:
+                batch = []
+
+            try:
+                self.write(batch)
+            except Exception as e:
+                print("Failed to persist messages: ", e)
+
+            if time.monotonic() - self.last_sync >= self.fsync_interval or done:
+                self.sync()
+
+            for kind, arg in batch:
+                if kind == "flush":
+                    self.sync()
+                    arg.set()
+
+    def write(self, batch: list[tuple]):
+        rows = [arg for kind, arg in batch if kind in ("message", "log")]
+        if rows:
+            with message_store.transaction():
+                for kind, arg in batch:
+                    if kind == "message":
+                        message_store.put(*arg)
+                    elif kind == "log":
+                        message_store.append_log(*arg)
+
+        for kind, arg in batch:
+            if kind == "audio":
+                m, pcm = arg
+                self.unsynced.append(m.write_audio(pcm))
+
+    def sync(self):
+        self.last_sync = time.monotonic()
+        message_store.checkpoint()
+
+        for path in self.unsynced:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self.unsynced.clear()
+
+
+_writer: Optional[PersistenceWriter] = None
+_writer_lock = Lock()
+
+
+def get_writer() -> PersistenceWriter:
+    """The writer for this process, started the first time it's needed"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = PersistenceWriter(settings.persist_fsync_interval)
+            _writer.start()
+    return _writer
@@ -0,0 +1,78 @@
+import hashlib
+from collections import deque
+from threading import Lock
+from typing import Optional
+
+from iris.server.encoding import Encoding, encode
+from iris.server.models import Message, log_day
+
+
+class RecentMessages:
+    """
+    The latest finished messages, newest first, pre-serialized so /recent-messages
+    can be answered from memory. The broker thread adds to it and the API reads it.
+    Like the daily log it starts over each day.
+    """
+
+    def __init__(self, max_size: int = 10):
+        self.max_size = max_size
+        self._messages: deque[tuple[str, bytes]] = deque()
+        self._day = log_day()
+        self._body: Optional[bytes] = None
+        self._etag = ""
+        self._lock = Lock()
+
+    def load(self, messages: list[Message]):
+        """
+        Fill the cache from messages ordered newest first. The log has a row for
+        every correction, only the newest one of each message is kept.
+        """
+        entries = {}
+        for m in messages:
+            if len(entries) == self.max_size:
+                break
+            entries.setdefault(str(m.id), m)
+
+        with self._lock:
+            self._day = log_day()
+            self._messages = deque(
+                (id, encode(m, Encoding.JSON_BINARY)) for id, m in entries.items()
+            )
+            self._body = None
+
+    def add(self, m: Message):
+        data = encode(m, Encoding.JSON_BINARY)
+        with self._lock:
+            self._roll_over()
+            # Corrections replace the version that is already here
+            self._messages = deque(
+                entry for entry in self._messages if entry[0] != str(m.id)
+            )
+            self._messages.appendleft((str(m.id), data))
+            while len(self._messages) > self.max_size:
+                self._messages.pop()
+            self._body = None
+
+    def clear(self):
+        with self._lock:
+            self._messages.clear()
+            self._body = None
+
+    def response(self) -> tuple[bytes, str]:
+        """The JSON list of messages and its ETag"""
+        with self._lock:
+            self._roll_over()
+            if self._body is None:
+                self._body = b"[" + b",".join(d for _, d in self._messages) + b"]"
+                digest = hashlib.blake2b(self._body, digest_size=8).hexdigest()
+                self._etag = f'"{digest}"'
+            return self._body, self._etag
+
+    def _roll_over(self):
+        if self._day != log_day():
+            self._day = log_day()
+            self._messages.clear()
+            self._body = None
+
+
+recent_messages = RecentMessages()
@@ -0,0 +1,120 @@
+from multiprocessing import shared_memory
+import queue
+from threading import Lock
+from typing import Hashable, Optional
+
+import numpy as np
+from pydantic import BaseModel
+from torch import multiprocessing as mp
+
+from iris.server import settings
+
+SAMPLE_RATE = 16000
+
+
+class AudioRef(BaseModel):
+    slab: int
+    samples: int
+
+
+class SlabPool:
+    """
+    Fixed set of shared memory blocks used to hand audio to the transcriber
+    processes. The web server copies a clip into a free slab and only an AudioRef
+    goes on the queue. The transcriber pool hands the slab back once the clip is
+    reported done, or once it gives up on it, whichever comes first.
+
+    The pool is created once in the web server and passed to the transcribers,
+    which attach to the same blocks by name.
+    """
+
+    def __init__(self, count: int, slab_seconds: int):
+        self.slab_samples = slab_seconds * SAMPLE_RATE
+        size = self.slab_samples * np.dtype(np.float32).itemsize
+        self.slabs = [
+            shared_memory.SharedMemory(create=True, size=size) for _ in range(count)
+        ]
+        self.free = mp.Queue()
+        for i in range(count):
+            self.free.put(i)
+        self.owner = True
+        # clip -> the slab it is in. Only kept in the web server, which is the only
+        # process that releases slabs.
+        self.clips: dict[Hashable, AudioRef] = {}
+        self.lock = Lock()
+
+    def __getstate__(self):
+        return {
+            "names": [slab.name for slab in self.slabs],
+            "slab_samples": self.slab_samples,
+            "free": self.free,
+        }
+
+    def __setstate__(self, state):
+        self.slabs = [shared_memory.SharedMemory(name=n) for n in state["names"]]
+        self.slab_samples = state["slab_samples"]
+        self.free = state["free"]
+        self.owner = False
+        self.clips = {}
+        self.lock = Lock()
+
+    def put(self, audio: np.ndarray) -> Optional[AudioRef]:
+        """
+        Copy audio into a free slab. Returns None if it doesn't fit or every slab is
+        in use, in which case the caller should send the audio on the queue instead.
+        """
+        if len(audio) > self.slab_samples:
+            return None
+
+        try:
+            slab = self.free.get_nowait()
+        except queue.Empty:
+            return None
+
+        ref = AudioRef(slab=slab, samples=len(audio))
+        self.view(ref)[:] = audio
+        return ref
+
+    def view(self, ref: AudioRef) -> np.ndarray:
+        """
+        The audio in a slab, without copying it. Only valid until the slab is
+        released.
+        """
+        return np.ndarray(
+            (ref.samples,), dtype=np.float32, buffer=self.slabs[ref.slab].buf
+        )
+
+    def claim(self, ref: AudioRef, clip: Hashable):
+        """Record which clip the slab holds. Slabs are released by clip."""
+        with self.lock:
+            self.clips[clip] = ref
+
+    def release(self, clip: Hashable):
+        """
+        Hand back the slab holding clip. Does nothing if it has already been
+        released, so the pool can give up on a clip and still get its result later.
+        """
+        with self.lock:
+            ref = self.clips.pop(clip, None)
+        if ref is not None:
+            self.free.put(ref.slab)
+
+    def close(self):
+        for slab in self.slabs:
+            slab.close()
+            if self.owner:
+                slab.unlink()
+
+
+_pool: Optional[SlabPool] = None
+
+
+def get_slab_pool() -> SlabPool:
+    """
+    The web server's slab pool. Transcriber processes get theirs passed in instead
+    of calling this.
+    """
+    global _pool
+    if _pool is None:
+        _pool = SlabPool(settings.audio_slab_count, settings.audio_slab_seconds)
+    return _pool
@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_user ON messages (user, timestamp);
+
+CREATE TABLE IF NOT EXISTS log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    day TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS log_day ON log (day, seq);
+"""
+
+
+class MessageStore:
+    """
+    SQLite database in WAL mode holding every message by id, plus the daily log of
+    finished messages. The web server and the transcriber processes all write to
+    it, so each thread opens its own connection the first time it's used.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        self.conn.execute("BEGIN")
+        try:
+            yield
+        except:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def checkpoint(self):
+        """Write the WAL back to the database file, fsyncing both"""
+        self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def put(self, id: str, user: str, timestamp: str, data: str):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO messages (id, user, timestamp, data) VALUES (?, ?, ?, ?)",
+            (id, user, timestamp, data),
+        )
+
+    def get(self, user: str, id: str) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT data FROM messages WHERE id = ? AND user = ?", (id, user)
+        ).fetchone()
+        return row[0] if row else None
+
+    def append_log(self, day: str, id: str, data: str):
+        self.conn.execute(
+            "INSERT INTO log (day, message_id, data) VALUES (?, ?, ?)", (day, id, data)
+        )
+
+    def last_logged(self, day: str, num_items: int) -> list[str]:
+        """The last num_items entries in the day's log, newest first"""
+        rows = self.conn.execute(
+            "SELECT data FROM log WHERE day = ? ORDER BY seq DESC LIMIT ?",
+            (day, num_items),
+        )
+        return [row[0] for row in rows]
+
+    def clear_log(self, day: str):
+        self.conn.execute("DELETE FROM log WHERE day = ?", (day,))
@@ -1,9 +1,17 @@
+from typing import Optional
+
 import faster_whisper
-from transformers import pipeline
 
+from iris.model_registry import get_pipeline, registry
+from iris.profiles import get_profile
 from iris.server import settings
 from iris.server.models import Message, StreamMode, TranscriptionMessage
+from iris.server.persistence import get_writer
+from iris.translation_cache import TranslationCache
+from iris.whisper_batch import SAMPLE_RATE, can_batch, transcribe_batch
+
 
+TRANSLATION_MODEL = "facebook/mbart-large-50-many-to-many-mmt"
 
 HELSINKI_TO_MBART = {
     "ru": "ru_RU",
@@ -14,40 +22,116 @@ HELSINKI_TO_MBART = {
 
 class Translator:
     def __init__(self):
-        self.model = pipe = pipeline(
+        self.precision = get_profile(
+            settings.performance_profile, settings.translation_device
+        ).translation_precision
+        registry.warmup(
+            "translation",
+            TRANSLATION_MODEL,
+            settings.translation_device,
+            self.precision,
+            example=None,
+        )
+        self.cache = TranslationCache(
+            max_size=settings.translation_cache_size,
+            path=settings.translation_cache_path,
+        )
+
+    def model(self):
+        return get_pipeline(
             "translation",
-            model="facebook/mbart-large-50-many-to-many-mmt",
-            device=settings.translation_device,
+            TRANSLATION_MODEL,
+            settings.translation_device,
+            self.precision,
         )
 
     def translate(self, text: str, lang_key: tuple[str, str]) -> str:
-        out = self.model(text, src_lang= HELSINKI_TO_MBART[lang_key[0]], tgt_lang= HELSINKI_TO_MBART[lang_key[1]])
-        return " ".join([m["translation_text"] for m in out])
+        if (cached := self.cache.get(text, *lang_key)) is not None:
+            return cached
+
+        out = self.model()(text, src_lang= HELSINKI_TO_MBART[lang_key[0]], tgt_lang= HELSINKI_TO_MBART[lang_key[1]])
+        translation = " ".join([m["translation_text"] for m in out])
+        self.cache.put(text, *lang_key, translation)
+        return translation
+
+    def translate_batch(self, items: list[tuple[str, tuple[str, str]]]) -> list[str]:
+        """
+        Translate a list of (text, lang_key) pairs. mbart can only be given one
+        source and target language per generate call, so there is one batch for each
+        language pair.
+        """
+        results = [""] * len(items)
+        by_key: dict[tuple[str, str], list[int]] = {}
+        for i, (text, lang_key) in enumerate(items):
+            if (cached := self.cache.get(text, *lang_key)) is not None:
+                results[i] = cached
+            else:
+                by_key.setdefault(lang_key, []).append(i)
+
+        for lang_key, idxs in by_key.items():
+            out = self.model()(
+                [items[i][0] for i in idxs],
+                src_lang=HELSINKI_TO_MBART[lang_key[0]],
+                tgt_lang=HELSINKI_TO_MBART[lang_key[1]],
+                batch_size=len(idxs),
+            )
+            for i, o in zip(idxs, out):
+                if isinstance(o, dict):
+                    o = [o]
+                results[i] = " ".join([m["translation_text"] for m in o])
+                self.cache.put(items[i][0], *lang_key, results[i])
+        return results
 
 
 class Transcriber:
+    """
+    Holds the accurate whisper model and, if whisper_fast_model is set, a smaller
+    one to fall back to when clips are piling up. choose_model() picks one per clip
+    and the name ends up on the Message.
+    """
+
     def __init__(self):
-        self.whisper = faster_whisper.WhisperModel(
+        self.accurate_model = settings.whisper_model
+        self.fast_model = settings.whisper_fast_model or settings.whisper_model
+        self.models = {
+            name: self.load_model(name)
+            for name in {self.accurate_model, self.fast_model}
+        }
+
+    @staticmethod
+    def load_model(name: str) -> faster_whisper.WhisperModel:
+        return faster_whisper.WhisperModel(
             # model_size_or_path="distil-large-v3",
-            model_size_or_path=settings.whisper_model,
+            model_size_or_path=name,
             device=settings.whisper_device,
-            cpu_threads=1,
+            cpu_threads=settings.whisper_cpu_threads,
             num_workers=1,
-            # compute_type="default",
+            compute_type=get_profile(
+                settings.performance_profile, settings.whisper_device
+            ).whisper_compute_type,
             # device_index=0,
             # num_workers=4,
         )
 
-    def transcribe(self, msg: TranscriptionMessage):
-
-        import time
-
-        ts = time.time()
-
+    def choose_model(self, msg: TranscriptionMessage, backlog: int) -> str:
+        """
+        backlog is the number of clips still waiting behind this one. A deep
+        backlog sends everything to the fast model, a shallow one only the long
+        clips, and partials always go there since they get replaced anyway.
+        """
+        if backlog >= settings.tier_queue_depth or msg.is_partial:
+            return self.fast_model
+        seconds = len(msg.audio) / SAMPLE_RATE
+        if backlog > 0 and seconds > settings.tier_long_clip_seconds:
+            return self.fast_model
+        return self.accurate_model
+
+    def transcribe(self, msg: TranscriptionMessage, model: Optional[str] = None):
+        model = model or self.accurate_model
         # audio_segment.export(f, format="wav")
-        segments, info = self.whisper.transcribe(
+        segments, info = self.models[model].transcribe(
             msg.audio,
-            language=msg.user.language,
+            language=msg.language,
             beam_size=5,
             # initial_prompt=None,
             # suppress_tokens=[-1],
@@ -57,15 +141,72 @@ class Transcriber:
 
         transcription = " ".join(seg.text for seg in segments)
         transcription = transcription.strip()
-        print(time.time() - ts)
 
+        return self.to_message(msg, transcription, model)
+
+    def transcribe_batch(
+        self, msgs: list[TranscriptionMessage], backlog: int = 0
+    ) -> list[Optional[Message]]:
+        """
+        Transcribe everything that fits in whisper's 30 second window in one batched
+        call per model. Longer clips, and ones the batched decode wasn't sure
+        about, fall back to transcribe().
+        """
+        by_model: dict[str, list[int]] = {}
+        for i, msg in enumerate(msgs):
+            by_model.setdefault(self.choose_model(msg, backlog), []).append(i)
+
+        results: list[Optional[Message]] = [None] * len(msgs)
+        for model, idxs in by_model.items():
+            batchable = [i for i in idxs if can_batch(msgs[i].audio)]
+            texts = {}
+            if len(batchable) > 1:
+                out = transcribe_batch(
+                    self.models[model],
+                    [msgs[i].audio for i in batchable],
+                    [msgs[i].language for i in batchable],
+                    beam_size=5,
+                )
+                # None means it needs transcribe()'s temperature fallback
+                texts = {i: t for i, t in zip(batchable, out) if t is not None}
+
+            for i in idxs:
+                if i in texts:
+                    results[i] = self.to_message(msgs[i], texts[i], model)
+                else:
+                    results[i] = self.transcribe(msgs[i], model)
+        return results
+
+    @staticmethod
+    def discarded(msg: TranscriptionMessage) -> Message:
+        return Message(
+            text="",
+            user=msg.user,
+            language=msg.language,
+            id=msg.message_id,
+            is_discarded=True,
+        )
+
+    def to_message(
+        self, msg: TranscriptionMessage, transcription: str, model: str
+    ) -> Optional[Message]:
         if not transcription:
+            if msg.had_partials and not msg.is_partial:
+                return self.discarded(msg)
             return None
 
-        m = Message(text=transcription, user=msg.user.name, language=msg.user.language)
+        m = Message(
+            text=transcription, user=msg.user, language=msg.language, model=model
+        )
+        if msg.message_id:
+            m.id = msg.message_id
+
+        # Partials only go out to the socket, the final pass is what gets kept
+        if msg.is_partial:
+            m.is_partial = True
+            return m
 
         if msg.recording_meta:
-            print(msg.recording_meta)
             if msg.recording_meta.mode == StreamMode.CONVERSATION:
                 m.is_accepted = True
                 m.is_conversation_mode = True
@@ -73,8 +214,7 @@ class Transcriber:
             if msg.recording_meta.re_recording:
                 m.re_recording = msg.recording_meta.re_recording
 
-        print(m)
-
-        m.save_to_file()
-        m.save_audio(msg.audio)
+        # The message itself is stored by the broker, which also writes the
+        # translation and any correction, so there's one writer for each row
+        get_writer().save_audio(m, msg.audio)
         return m
@@ -1,15 +1,63 @@
-from collections import deque
+import queue
+import time
+from concurrent.futures import Future
+from threading import Thread
 from typing import Callable, Optional
 
 import numpy as np
-import torch
+
+from iris.audio_buffer import AudioBuffer
+from iris.vad_model import FRAME_SAMPLES, VADState, speech_probs
+from iris.queues import drain
 
 CHUNK_SECONDS = 2
 
 
-# TODO: I want to refactor audio worker to user this class
+class VADScheduler(Thread):
+    """
+    Collects frames from every connected stream and runs them through silero as a
+    single batch. Each frame needs the state left behind by the one before it, so a
+    stream must wait for its result before submitting its next frame.
+    """
+
+    def __init__(self, max_batch: int = 64, max_wait: float = 0.002, **kwargs):
+        super().__init__(daemon=True, **kwargs)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.frames = queue.Queue()
+
+    def submit(self, frame: np.ndarray, state: VADState) -> Future:
+        fut = Future()
+        self.frames.put((frame, state, fut))
+        return fut
+
+    def stop(self):
+        self.frames.put(None)
+
+    def run(self):
+        done = False
+        while not done:
+            batch, done = drain(self.frames, self.max_batch, self.max_wait)
+            if not batch:
+                continue
+
+            try:
+                probs = speech_probs(
+                    [frame for frame, _, _ in batch], [state for _, state, _ in batch]
+                )
+            except Exception as e:
+                for _, _, fut in batch:
+                    fut.set_exception(e)
+                continue
+
+            for (_, _, fut), prob in zip(batch, probs):
+                fut.set_result(prob)
+
+
+vad_scheduler = VADScheduler()
 
-VAD_MODEL, _ = torch.hub.load(repo_or_dir="snakers4/silero-vad", model="silero_vad")
+
+# TODO: I want to refactor audio worker to user this class
 
 
 class VADHandler:
@@ -25,59 +73,82 @@ class VADHandler:
             ]
         ] = None,
         on_data_ready: Optional[Callable[[np.ndarray], None]] = None,
+        on_partial: Optional[Callable[[np.ndarray], None]] = None,
+        partial_interval_ms: int = 0,
     ):
         self.vad_threshold = vad_threshold
 
         self.on_recording_state_change = on_recording_state_change
         self.on_data_ready = on_data_ready
+        # Called with everything recorded so far every partial_interval_ms while
+        # speech is being recorded. 0 turns it off.
+        self.on_partial = on_partial
+        self.partial_frames = int(partial_interval_ms / 32)
+        self.frames_since_partial = 0
 
-        self.model = VAD_MODEL
+        self.vad_state = VADState()
         self.frames_per_second = int(1000 / 32)
         self.vad_countdown = 0
-        self.buffer = []
         self.first_pause = True
         self.counter = 0
-        self.rolling_buffer = deque(maxlen=int(self.frames_per_second / 2))
+        # Holds half a second of pre-roll plus the recording
+        self.buffer = AudioBuffer(
+            preroll_samples=int(self.frames_per_second / 2) * FRAME_SAMPLES
+        )
         self.recording = False
         self.vad_during_buffer = False
+        # When the last frame with speech in it was seen, for latency metrics.
+        # Everything after it is the wait for the pause that ends the utterance.
+        self.speech_end: Optional[float] = None
 
-    def process_stream(self, sound):
-        audio_int16 = np.frombuffer(sound, np.int16)
-        abs_max = np.abs(audio_int16).max()
-        sound = audio_int16.astype(np.float32)
-        if abs_max > 0:
-            sound *= 1 / 32768
-        sound = sound.squeeze()  # depends on the use case
-        return sound
+    def stage(self, aud) -> np.ndarray:
+        """
+        Write the next frame into the buffer and return it as float32 for silero.
+        vad() decides whether to keep it.
+        """
+        return self.buffer.write(aud)
 
     def send_audio(self):
         print("sending audio")
         if self.on_data_ready and self.vad_during_buffer:
             self.on_data_ready(self.get_whisper_audio())
         self.vad_during_buffer = False
+        self.frames_since_partial = 0
         self.buffer.clear()
-        self.rolling_buffer.clear()
+
+    def send_partial(self):
+        self.frames_since_partial += 1
+        if self.frames_since_partial < self.partial_frames:
+            return
+
+        self.frames_since_partial = 0
+        self.on_partial(self.get_whisper_audio())
 
     def send_recording_state(self, is_recording):
         if self.on_recording_state_change:
             self.on_recording_state_change(is_recording)
 
     def get_whisper_audio(self):
-        return self.process_stream(
-            np.frombuffer(
-                b"".join(list(self.rolling_buffer) + self.buffer), dtype=np.int16
-            )
-        )
+        return self.buffer.get_audio()
+
+    def vad(self, aud, no_vad=False, speech_prob: Optional[float] = None):
+        frame = self.stage(aud)
 
-    def vad(self, aud, no_vad=False):
         if no_vad:
             vad = 1
+        elif speech_prob is not None:
+            vad = speech_prob
         else:
-            vad = self.model(torch.from_numpy(self.process_stream(aud)), 16000).item()
+            vad = speech_probs([frame], [self.vad_state])[0]
+
+        if vad >= self.vad_threshold:
+            self.speech_end = time.time()
 
         if (vad >= self.vad_threshold and not self.recording) or vad >= 0.8:
             self.vad_during_buffer = True
-            over_time = len(self.buffer) / self.frames_per_second
+            over_time = (
+                self.buffer.recorded_samples / FRAME_SAMPLES / self.frames_per_second
+            )
             if over_time >= CHUNK_SECONDS + 1:
                 diff = over_time - CHUNK_SECONDS
                 self.vad_countdown = int(self.frames_per_second * (1 / diff))
@@ -96,10 +167,12 @@ class VADHandler:
             self.recording = False
 
         if self.recording:
-            self.buffer.append(aud)
+            self.buffer.commit(recording=True)
+            if self.on_partial and self.partial_frames and self.vad_during_buffer:
+                self.send_partial()
 
-        elif len(self.buffer) != 0:
+        elif self.buffer.recorded_samples != 0:
             self.send_audio()
 
         else:
-            self.rolling_buffer.append(aud)
+            self.buffer.commit(recording=False)
@@ -1,16 +1,30 @@
+import asyncio
 import io
-from collections import deque
-from typing import Optional
+import json
+import queue
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Optional
+from uuid import uuid4
 
 import numpy as np
 import pyogg
-import torch
 from fastapi import WebSocket
 from mutagen.ogg import OggPage
 
-from iris.server import audio_in_q
-from iris.server.models import StreamMessage, StreamMode, TranscriptionMessage, User
-from iris.server.vad import VADHandler
+from iris.server import SocketChannel, audio_in_q, settings, whisper_out_q
+from iris.server.load import estimated_wait, is_overloaded
+from iris.server.models import (
+    Message,
+    StreamMessage,
+    StreamMode,
+    TranscriptionMessage,
+    User,
+)
+from iris.server.shared_audio import get_slab_pool
+from iris.server.vad import VADHandler, vad_scheduler
 
 SAMPLE_RATE = 16000
 SAMPLES_PER_MS = int(SAMPLE_RATE / 1000)
@@ -18,6 +32,17 @@ SAMPLES_PER_MS = int(SAMPLE_RATE / 1000)
 # Silero chunks are 32 ms and 16 bits each (2 bytes)
 BYTES_PER_SILERO_FRAME = SAMPLES_PER_MS * 32 * 2
 
+# Clip counter for each user. The transcriber pool uses it to return each user's
+# messages in the order they were recorded, and waits for every number in turn, so
+# a number is only used up once its clip is actually on the queue.
+clip_seq: dict[str, int] = defaultdict(int)
+clip_seq_lock = Lock()
+
+# Opus decoding is CPU bound, so it runs here instead of on the event loop
+stream_executor = ThreadPoolExecutor(
+    max_workers=settings.stream_workers, thread_name_prefix="stream"
+)
+
 
 def chunks(lst, n):
     """Yield successive n-sized chunks from lst."""
@@ -61,65 +86,212 @@ def decode(data, opus_decoder, leftover_bits: Optional[bytearray] = None):
     return arrange_frames(frames)
 
 
-async def receive_stream(websocket: WebSocket, user: User):
-    is_streaming = False
-    recording_meta = None
-    opus_decoder = pyogg.OpusDecoder()
-    opus_decoder.set_channels(1)
-    opus_decoder.set_sampling_frequency(SAMPLE_RATE)
-
-    vad_model, utils = torch.hub.load(
-        repo_or_dir="snakers4/silero-vad", model="silero_vad"
-    )
-
-    remainder = None
-    buffer = deque()
-
-    vad = VADHandler()
-
-    while True:
-        data = await websocket.receive()
+class AudioStream:
+    """
+    Decoder and VAD state for one websocket connection. Opus decoding and stop() run
+    on the stream executor and silero runs on the shared VAD scheduler. A connection
+    only ever has one of these running at a time, so nothing here needs a lock.
+    """
 
+    def __init__(self, user: User, on_status: Optional[Callable[[dict], None]] = None):
+        self.user = user
+        # Called, possibly off the event loop, when the server starts or stops
+        # being overloaded and when a clip gets rejected
+        self.on_status = on_status
+        self.overloaded = False
+        self.is_streaming = False
+        self.recording_meta = None
+        self.remainder = None
+
+        self.opus_decoder = pyogg.OpusDecoder()
+        self.opus_decoder.set_channels(1)
+        self.opus_decoder.set_sampling_frequency(SAMPLE_RATE)
+
+        self.vad = VADHandler(partial_interval_ms=settings.partial_interval_ms)
+        # Partial transcripts and the final one for an utterance share this id so
+        # clients can replace the provisional text
+        self.utterance_id = uuid4()
+        # Whether any partials have been queued for the current utterance
+        self.partials_sent = False
+
+    def start(self, recording_meta: StreamMessage):
+        print("start stream")
+        user = self.user
+
+        def transcribe(audio, is_partial=False):
+            overloaded = self.check_overload()
+
+            # Partials are only a preview, don't make the final text wait on them
+            if is_partial and overloaded:
+                return
+
+            print("TRANSCRIBING")
+            msg = TranscriptionMessage(
+                user=user.name,
+                language=user.language,
+                recording_meta=recording_meta,
+                message_id=self.utterance_id,
+                is_partial=is_partial,
+                had_partials=self.partials_sent,
+                timings={"speech_end": self.vad.speech_end or time.time()},
+            )
+            msg.audio_ref = get_slab_pool().put(audio)
+            if msg.audio_ref is None:
+                msg.audio = audio
+            msg.timings["vad"] = time.time()
+            try:
+                with clip_seq_lock:
+                    msg.seq = clip_seq[user.name]
+                    if msg.audio_ref is not None:
+                        get_slab_pool().claim(msg.audio_ref, (user.name, msg.seq))
+                    audio_in_q.put_nowait(msg)
+                    clip_seq[user.name] += 1
+            except queue.Full:
+                print("Transcription queue full, dropping clip for ", user.name)
+                get_slab_pool().release((user.name, msg.seq))
+                if not is_partial:
+                    self.send_status(rejected=True)
+                    if self.partials_sent:
+                        self.discard_utterance()
+                    self.new_utterance()
+                return
+
+            if is_partial:
+                self.partials_sent = True
+            else:
+                self.new_utterance()
+
+        self.vad.on_data_ready = transcribe
+        self.vad.on_partial = lambda audio: transcribe(audio, is_partial=True)
+        self.recording_meta = recording_meta
+        self.is_streaming = True
+        self.remainder = None
+
+    def check_overload(self) -> bool:
+        """Let the client know if the server started or stopped being overloaded"""
+        overloaded = is_overloaded()
+        if overloaded != self.overloaded:
+            self.overloaded = overloaded
+            self.send_status()
+        return overloaded
+
+    def new_utterance(self):
+        self.utterance_id = uuid4()
+        self.partials_sent = False
+
+    def discard_utterance(self):
+        """Tell clients to drop the partials shown for the current utterance"""
+        m = Message(
+            text="",
+            user=self.user.name,
+            language=self.user.language,
+            id=self.utterance_id,
+            is_discarded=True,
+        )
+        try:
+            whisper_out_q.put_nowait(m)
+        except queue.Full:
+            print("Couldn't discard partials for ", self.user.name)
+
+    def send_status(self, rejected: bool = False):
+        if self.on_status is not None:
+            self.on_status(
+                {
+                    "status": {
+                        "overloaded": self.overloaded,
+                        "estimated_wait": estimated_wait(),
+                        "rejected": rejected,
+                    }
+                }
+            )
+
+    def decode(self, data) -> list[bytearray]:
+        frames, self.remainder = decode(
+            data, self.opus_decoder, leftover_bits=self.remainder
+        )
+        return frames
+
+    async def feed(self, data):
+        loop = asyncio.get_running_loop()
+        frames = await loop.run_in_executor(stream_executor, self.decode, data)
+
+        for frame in frames:
+            if self.recording_meta.mode == StreamMode.CONVERSATION:
+                speech_prob = await asyncio.wrap_future(
+                    vad_scheduler.submit(self.vad.stage(frame), self.vad.vad_state)
+                )
+                self.vad.vad(frame, speech_prob=speech_prob)
+            else:
+                self.vad.vad(frame, no_vad=True)
+
+    def stop(self):
+        self.vad.send_audio()
+        print("end stream")
+
+
+async def process_stream(
+    channel: SocketChannel, stream: AudioStream, pending: asyncio.Queue
+):
+    loop = asyncio.get_running_loop()
+
+    while (data := await pending.get()) is not None:
         if "text" in data:
             action, stream_meta = data["text"].split(":", maxsplit=1)
 
             recording_meta = StreamMessage.model_validate_json(stream_meta)
 
             if action == "START":
-                print("start stream")
-                start_meta = recording_meta
-
-                def transcribe(audio):
-                    print("TRANSCRIBING")
-                    audio_in_q.put(
-                        TranscriptionMessage(
-                            audio=audio, user=user, recording_meta=start_meta
-                        )
-                    )
-
-                vad.on_data_ready = transcribe
-
-                is_streaming = True
-                remainder = None
-                buffer = deque()
+                stream.start(recording_meta)
 
             elif action == "CANCEL":
-                is_streaming = False
-                await websocket.send_json({})
+                stream.is_streaming = False
+                channel.put("{}")
 
             elif action == "STOP":
-                is_streaming = False
-                vad.send_audio()
+                stream.is_streaming = False
+                await loop.run_in_executor(stream_executor, stream.stop)
 
-                await websocket.send_json({})
+                channel.put("{}")
 
-                print("end stream")
+        elif stream.is_streaming:
+            await stream.feed(data)
 
-        elif is_streaming:
-            frames, remainder = decode(data, opus_decoder, leftover_bits=remainder)
 
-            for frame in frames:
-                if recording_meta.mode == StreamMode.CONVERSATION:
-                    vad.vad(frame)
-                else:
-                    vad.vad(frame, no_vad=True)
+async def receive_stream(websocket: WebSocket, user: User, channel: SocketChannel):
+    """
+    Read audio from websocket. Replies go through channel, the socket's broker
+    channel, so they are never sent at the same time as a message.
+    """
+
+    def send_status(status: dict):
+        # Status frames are always JSON text, whatever the channel's encoding
+        channel.loop.call_soon_threadsafe(channel.put, json.dumps(status))
+
+    stream = AudioStream(user, on_status=send_status)
+
+    # Overload is also checked between recordings, so the client hears when the
+    # backlog has cleared without having to record something first
+    async def watch_overload():
+        while True:
+            await asyncio.sleep(1)
+            stream.check_overload()
+
+    watcher = asyncio.create_task(watch_overload())
+
+    # Decoding and VAD happen on the stream executor. If a connection gets too far
+    # behind we stop reading from its socket until it catches up.
+    pending = asyncio.Queue(maxsize=settings.stream_queue_size)
+    processor = asyncio.create_task(process_stream(channel, stream, pending))
+
+    try:
+        while not processor.done():
+            data = await websocket.receive()
+            if data["type"] == "websocket.disconnect":
+                break
+
+            await pending.put(data)
+    finally:
+        watcher.cancel()
+        if not processor.done():
+            await pending.put(None)
+        await processor
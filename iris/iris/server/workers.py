@@ -1,11 +1,75 @@
 import asyncio
+import queue
+import time
+from collections import defaultdict
 from threading import Thread
+from typing import Optional
 
 from torch import multiprocessing as mp
 
 from iris.server import MessageBroker, settings
+from iris.server.load import depth
+from iris.server.metrics import observe_stage, translation_cache
 from iris.server.models import Message, TranscriptionMessage
+from iris.server.persistence import get_writer
+from iris.server.recent import recent_messages
+from iris.server.shared_audio import SlabPool
 from iris.server.transcription import Transcriber, Translator
+from iris.queues import drain
+
+
+def _resolve(fut: asyncio.Future, result=None, error: Optional[Exception] = None):
+    if fut.done():
+        return
+    if error:
+        fut.set_exception(error)
+    else:
+        fut.set_result(result)
+
+
+class TranslationExecutor(Thread):
+    """
+    Runs the translation model on its own thread so that the broker's event loop
+    never waits on it. Everything that has queued up since the last run is
+    translated together.
+    """
+
+    def __init__(self, translator: Translator, max_batch: int = 32, **kwargs):
+        super().__init__(daemon=True, **kwargs)
+        self.translator = translator
+        self.max_batch = max_batch
+        self.jobs = queue.Queue()
+
+    def submit(self, text: str, lang_keys: list[tuple[str, str]]) -> asyncio.Future:
+        """
+        Queue text to be translated into each lang_key. The returned future
+        resolves on the calling event loop with one translation per lang_key.
+        """
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.jobs.put((text, lang_keys, loop, fut))
+        return fut
+
+    def stop(self):
+        self.jobs.put(None)
+
+    def run(self):
+        done = False
+        while not done:
+            batch, done = drain(self.jobs, self.max_batch, 0)
+            if not batch:
+                continue
+
+            items = [(text, key) for text, keys, _, _ in batch for key in keys]
+            try:
+                out = iter(self.translator.translate_batch(items))
+            except Exception as e:
+                for _, _, loop, fut in batch:
+                    loop.call_soon_threadsafe(_resolve, fut, None, e)
+                continue
+
+            for _, keys, loop, fut in batch:
+                loop.call_soon_threadsafe(_resolve, fut, [next(out) for _ in keys])
 
 
 class BrokerThread(Thread):
@@ -15,52 +79,336 @@ class BrokerThread(Thread):
 
         self.broker = broker
         self.whisper_out = whisper_out
-        self.translator = Translator()
+        self.translations = TranslationExecutor(Translator())
+        cache = self.translations.translator.cache
+        for stat in ("size", "hits", "misses"):
+            translation_cache.set_function(stat, lambda stat=stat: cache.stats()[stat])
         print("Broker online")
 
     def run(self):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
 
+        self.translations.start()
         loop.run_until_complete(self.a_run())
+        self.translations.stop()
+        self.translations.translator.cache.save()
         loop.close()
 
     async def a_run(self):
+        loop = asyncio.get_running_loop()
+        # Keep references to running translations so they don't get garbage collected
+        tasks: set[asyncio.Task] = set()
+
         msg: Message
-        for msg in iter(self.whisper_out.get, None):
+        while True:
+            msg = await loop.run_in_executor(None, self.whisper_out.get)
+            if msg is None:
+                break
+
+            if not msg.is_partial:
+                # From the last frame with speech, so mostly the pause that ends
+                # the utterance
+                observe_stage("vad", msg.timings, "speech_end", "vad")
+                observe_stage("queue", msg.timings, "vad", "whisper_start")
+                observe_stage("whisper", msg.timings, "whisper_start", "whisper_end")
+                # Waiting for earlier clips from the same user, then whisper_out
+                observe_stage("reorder", msg.timings, "whisper_end")
+
             if msg.is_accepted:
-                await self.translate_and_send(msg)
+                msg.timings["translate_start"] = time.time()
+                task = loop.create_task(self.translate_and_send(msg))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
             else:
-                await self.broker.send(msg.json())
+                # Queued for writing before the client can see it and accept it
+                if not msg.is_partial and not msg.is_discarded:
+                    get_writer().save_message(msg)
+                await self.broker.send(msg, key=str(msg.id))
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
 
     async def translate_and_send(self, m: Message):
-        print("adding translation")
         if m.language == settings.base_language:
-            for lang in settings.supported_languages:
-                m.translated_text[lang] = self.translator.translate(
-                    m.text, (m.language, lang)
-                )
+            targets = settings.supported_languages
         else:
-            m.translated_text[settings.base_language] = self.translator.translate(
-                m.text,
-                (m.language, settings.base_language),
+            targets = [settings.base_language]
+
+        try:
+            translations = await self.translations.submit(
+                m.text, [(m.language, lang) for lang in targets]
             )
+            m.translated_text.update(zip(targets, translations))
+        except Exception as e:
+            # Better to show the original text than to lose the message
+            print(f"Translation failed for {m.id}, sending it untranslated: ", e)
+        observe_stage("translate", m.timings, "translate_start")
 
-        await self.broker.send(m.json())
-        m.save_to_file()
-        m.save_to_log()
+        writer = get_writer()
+        writer.save_message(m)
+        writer.save_log(m)
+        await self.broker.send(m, key=str(m.id))
+        # What the speaker waits for after they stop talking
+        observe_stage("total", m.timings, "speech_end")
+        recent_messages.add(m)
 
 
-def whisper_process(audio_in_q: mp.Queue, out_q: mp.Queue):
-    print("Starting transcriber")
+def whisper_process(
+    audio_in_q: mp.Queue, out_q: mp.Queue, slabs: SlabPool, worker_id: int = 0
+):
+    print(f"Starting transcriber {worker_id}")
     transcriber = Transcriber()
-    print("Transcriber online")
+    print(f"Transcriber {worker_id} online")
 
-    msg: TranscriptionMessage
+    batch: list[TranscriptionMessage]
+    done = False
     try:
-        for msg in iter(audio_in_q.get, None):
-            m = transcriber.transcribe(msg)
-            if m:
-                out_q.put(m)
+        while not done:
+            batch, done = drain(
+                audio_in_q,
+                settings.transcribe_batch_size,
+                settings.transcribe_batch_wait_ms / 1000,
+            )
+            if not batch:
+                continue
+
+            # Let the pool know what we're working on in case this process dies
+            out_q.put(
+                (
+                    "start",
+                    worker_id,
+                    [(msg.user, msg.seq) for msg in batch],
+                )
+            )
+            try:
+                for msg in batch:
+                    if msg.audio_ref:
+                        msg.audio = slabs.view(msg.audio_ref)
+
+                # A partial is stale if a newer pass over the same utterance is
+                # also here
+                latest = {msg.message_id: msg for msg in batch if msg.message_id}
+                work = [
+                    msg
+                    for msg in batch
+                    if not msg.is_partial or latest[msg.message_id] is msg
+                ]
+                whisper_start = time.time()
+                out = transcriber.transcribe_batch(work, backlog=depth(audio_in_q))
+                results = dict(zip(map(id, work), out))
+                whisper_end = time.time()
+            except Exception as e:
+                # Still reported as done below, so the slabs are released and the
+                # users' later clips aren't held up waiting for these
+                print(f"Transcriber {worker_id} failed on a batch: ", e)
+                results = {}
+
+            for msg in batch:
+                if m := results.get(id(msg)):
+                    m.timings = {
+                        **msg.timings,
+                        "whisper_start": whisper_start,
+                        "whisper_end": whisper_end,
+                    }
+
+            # The slab views aren't used after this. The pool hands the slabs back
+            # when it gets the done message, or when it gives up on this process.
+            for msg in batch:
+                msg.audio = None
+            for msg in batch:
+                out_q.put(("done", worker_id, msg.user, msg.seq, results.get(id(msg))))
     except KeyboardInterrupt:
         exit()
+    finally:
+        get_writer().stop(timeout=10)
+
+
+class TranscriberPool(Thread):
+    """
+    Runs several whisper_process workers that all read from the same audio queue.
+    Workers can finish out of order, so results are held here until every earlier
+    clip from the same user has come back. Dead workers get restarted.
+    """
+
+    def __init__(
+        self,
+        audio_in: mp.Queue,
+        out: mp.Queue,
+        slabs: SlabPool,
+        num_workers: int,
+        reorder_timeout: float = 30,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.audio_in = audio_in
+        self.out = out
+        self.slabs = slabs
+        self.num_workers = max(1, num_workers)
+        self.reorder_timeout = reorder_timeout
+        self.results = mp.Queue()
+        # Every process gets a new worker id, so messages from one that has died
+        # can't be mistaken for its replacement's
+        self.procs: dict[int, mp.Process] = {}
+        self.next_worker_id = 0
+        self.stopping = False
+        self.finished = False
+        self.last_health_check = 0.0
+
+        # worker id -> (user, seq) of the clips it is transcribing
+        self.in_flight: dict[int, list[tuple[str, int]]] = {}
+        # user -> seq of the next result to forward
+        self.next_seq: dict[str, int] = defaultdict(int)
+        # user -> {seq: result} for results that came back early
+        self.pending: dict[str, dict[int, Optional[Message]]] = defaultdict(dict)
+        # user -> when results started waiting on the current next_seq
+        self.waiting_since: dict[str, float] = {}
+
+    def spawn(self):
+        worker_id = self.next_worker_id
+        self.next_worker_id += 1
+        proc = mp.Process(
+            target=whisper_process,
+            args=[self.audio_in, self.results, self.slabs, worker_id],
+        )
+        proc.start()
+        self.procs[worker_id] = proc
+
+    def run(self):
+        for _ in range(self.num_workers):
+            self.spawn()
+
+        while not self.finished:
+            try:
+                self.handle(self.results.get(timeout=1))
+            except queue.Empty:
+                pass
+
+            if time.monotonic() - self.last_health_check >= 1:
+                self.check_workers()
+
+    def handle(self, result: Optional[tuple]):
+        if result is None:
+            self.finished = True
+            return
+
+        kind, worker_id, *rest = result
+        if kind == "start":
+            if worker_id in self.procs:
+                self.in_flight[worker_id] = rest[0]
+            else:
+                # The worker was already given up on before this got here
+                self.abandon(rest[0])
+        else:
+            user, seq, m = rest
+            self.in_flight[worker_id] = [
+                clip
+                for clip in self.in_flight.get(worker_id, [])
+                if clip[:2] != (user, seq)
+            ]
+            self.slabs.release((user, seq))
+            self.complete(user, seq, m)
+
+    def drain_results(self):
+        while not self.finished:
+            try:
+                self.handle(self.results.get_nowait())
+            except queue.Empty:
+                return
+
+    def complete(self, user: str, seq: int, m: Optional[Message]):
+        # Late result for a clip we already gave up on
+        if seq < self.next_seq[user]:
+            return
+
+        self.pending[user][seq] = m
+        self.forward(user)
+
+    def forward(self, user: str):
+        pending = self.pending[user]
+        start = self.next_seq[user]
+        while self.next_seq[user] in pending:
+            m = pending.pop(self.next_seq[user])
+            self.next_seq[user] += 1
+            if m:
+                self.out.put(m)
+        if self.next_seq[user] != start or not pending:
+            self.waiting_since.pop(user, None)
+
+    def abandon(self, clips: list[tuple[str, int]]):
+        """Skip clips that will never come back, so later ones aren't stuck"""
+        for user, seq in clips:
+            self.slabs.release((user, seq))
+            self.complete(user, seq, None)
+
+    def check_workers(self):
+        self.last_health_check = time.monotonic()
+        if self.stopping:
+            return
+
+        dead = [i for i, proc in self.procs.items() if not proc.is_alive()]
+        if dead:
+            # Whatever a dead worker sent before it died has to be handled first,
+            # otherwise clips it finished would look lost and be dropped
+            self.drain_results()
+        for i in dead:
+            proc = self.procs.pop(i)
+            print(f"Transcriber {i} died with exit code {proc.exitcode}, restarting")
+            self.abandon(self.in_flight.pop(i, []))
+            self.spawn()
+
+        self.skip_lost()
+
+    def skip_lost(self):
+        """
+        A clip can disappear without the pool hearing about it, for example when a
+        worker dies after taking it off the queue but before reporting it. Once a
+        user's later results have waited reorder_timeout seconds on clips no worker
+        has, those clips are skipped.
+        """
+        now = time.monotonic()
+        working = {clip for clips in self.in_flight.values() for clip in clips}
+        for user, pending in self.pending.items():
+            if not pending:
+                continue
+            since = self.waiting_since.setdefault(user, now)
+            if now - since < self.reorder_timeout:
+                continue
+
+            skipped = self.next_seq[user]
+            while (
+                self.next_seq[user] < min(pending)
+                and (user, self.next_seq[user]) not in working
+            ):
+                self.slabs.release((user, self.next_seq[user]))
+                self.next_seq[user] += 1
+            if self.next_seq[user] != skipped:
+                print(f"Skipping {user}'s clips {skipped}-{self.next_seq[user] - 1}")
+                self.waiting_since.pop(user, None)
+                self.forward(user)
+
+    def stop(self, timeout: float = 30):
+        """
+        Let the workers finish the clips already queued, forward their results and
+        then stop. Blocks for up to about timeout seconds, after which workers that
+        are still going are terminated.
+        """
+        self.stopping = True
+        deadline = time.monotonic() + timeout
+        procs = list(self.procs.values())
+        for _ in procs:
+            try:
+                self.audio_in.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+
+        for proc in procs:
+            proc.join(max(0, deadline - time.monotonic()))
+            if proc.is_alive():
+                print(f"Transcriber {proc.pid} didn't stop in time, terminating")
+                proc.terminate()
+                proc.join()
+
+        # Goes in after everything the workers sent, so it's handled last
+        self.results.put(None)
+        self.join(max(1, deadline - time.monotonic()))
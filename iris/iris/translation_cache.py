@@ -0,0 +1,95 @@
+import json
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+CacheKey = tuple[str, str, str]
+
+
+class TranslationCache:
+    """
+    Bounded LRU of finished translations keyed by (text, source lang, target lang).
+    If a path is given the cache is loaded from it on startup and written back every
+    save_every new entries and whenever save() is called.
+    """
+
+    def __init__(
+        self, max_size: int = 2048, path: Optional[str] = None, save_every: int = 64
+    ):
+        self.max_size = max_size
+        self.path = path
+        self.save_every = save_every
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[CacheKey, str] = OrderedDict()
+        self._unsaved = 0
+        self._lock = Lock()
+        self._save_lock = Lock()
+
+        if self.path:
+            self.load()
+
+    @staticmethod
+    def key(text: str, src: str, tgt: str) -> CacheKey:
+        # Whisper output varies in spacing a lot more than in wording
+        return (" ".join(text.split()), src, tgt)
+
+    def get(self, text: str, src: str, tgt: str) -> Optional[str]:
+        key = self.key(text, src, tgt)
+        with self._lock:
+            translation = self._entries.get(key)
+            if translation is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return translation
+
+    def put(self, text: str, src: str, tgt: str, translation: str):
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            key = self.key(text, src, tgt)
+            self._entries[key] = translation
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._unsaved += 1
+            should_save = self.path and self._unsaved >= self.save_every
+
+        if should_save:
+            self.save()
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+        with self._lock:
+            for text, src, tgt, translation in entries[-self.max_size :]:
+                self._entries[(text, src, tgt)] = translation
+
+    def save(self):
+        if not self.path:
+            return
+
+        with self._lock:
+            entries = [[*key, value] for key, value in self._entries.items()]
+            self._unsaved = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with self._save_lock:
+            with open(tmp_path, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
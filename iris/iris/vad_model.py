@@ -0,0 +1,75 @@
+from dataclasses import dataclass, field
+from threading import Lock
+
+import numpy as np
+import torch
+
+SAMPLE_RATE = 16000
+# Silero takes 32 ms frames and prepends the last 4 ms of the previous frame
+FRAME_SAMPLES = 512
+CONTEXT_SAMPLES = 64
+STATE_SIZE = 128
+
+_model = None
+_load_lock = Lock()
+_run_lock = Lock()
+
+
+def get_vad_model():
+    """
+    Returns the process wide silero model, loading it and running a frame through
+    it the first time so that later callers don't pay for either.
+    """
+    global _model
+    with _load_lock:
+        if _model is None:
+            model, _ = torch.hub.load(
+                repo_or_dir="snakers4/silero-vad", model="silero_vad"
+            )
+            with torch.no_grad():
+                model(torch.zeros(1, FRAME_SAMPLES), SAMPLE_RATE)
+            model.reset_states()
+            _model = model
+    return _model
+
+
+@dataclass
+class VADState:
+    """
+    Recurrent state for one audio stream. The model itself is shared, so giving a
+    stream its own VAD only costs these two small tensors.
+    """
+
+    state: torch.Tensor = field(default_factory=lambda: torch.zeros(2, 1, STATE_SIZE))
+    context: torch.Tensor = field(
+        default_factory=lambda: torch.zeros(1, CONTEXT_SAMPLES)
+    )
+
+    def reset(self):
+        self.state = torch.zeros(2, 1, STATE_SIZE)
+        self.context = torch.zeros(1, CONTEXT_SAMPLES)
+
+
+def speech_probs(frames: list[np.ndarray], states: list[VADState]) -> list[float]:
+    """
+    Run one float32 frame from each stream through the shared model as a single
+    batch. The model keeps its recurrent state in the same attributes silero's own
+    reset_states() uses, so each stream's state is swapped in before the call and
+    read back out after it.
+    """
+    model = get_vad_model()
+    x = torch.from_numpy(np.stack(frames))
+
+    with _run_lock, torch.no_grad():
+        model._state = torch.cat([s.state for s in states], dim=1)
+        model._context = torch.cat([s.context for s in states], dim=0)
+        model._last_sr = SAMPLE_RATE
+        model._last_batch_size = len(states)
+
+        out = model(x, SAMPLE_RATE)
+
+        for i, s in enumerate(states):
+            s.state = model._state[:, i : i + 1]
+            s.context = model._context[i : i + 1]
+
+    return out.squeeze(-1).tolist()
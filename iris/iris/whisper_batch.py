@@ -0,0 +1,94 @@
+import zlib
+from typing import Optional, Sequence
+
+import faster_whisper
+import numpy as np
+from faster_whisper.tokenizer import Tokenizer
+
+SAMPLE_RATE = 16000
+
+# Whisper's encoder always looks at a 30 second window. Anything longer has to go
+# through WhisperModel.transcribe so it can be split up.
+MAX_BATCH_SECONDS = 30
+MAX_DECODE_TOKENS = 448
+
+
+def can_batch(audio: np.ndarray) -> bool:
+    return len(audio) <= MAX_BATCH_SECONDS * SAMPLE_RATE
+
+
+def compression_ratio(text: str) -> float:
+    data = text.encode("utf-8")
+    return len(data) / len(zlib.compress(data))
+
+
+def transcribe_batch(
+    model: faster_whisper.WhisperModel,
+    audios: list[np.ndarray],
+    languages: list[str],
+    beam_size: int = 5,
+    suppress_tokens: Sequence[int] = (-1,),
+    no_speech_threshold: float = 0.6,
+    log_prob_threshold: float = -1.0,
+    compression_ratio_threshold: float = 2.4,
+) -> list[Optional[str]]:
+    """
+    Decode several clips of up to 30 seconds with a single encoder and generate
+    call. Each clip can have its own language.
+
+    Silence is decided the way WhisperModel.transcribe decides it. Clips it would
+    retry at a higher temperature come back as None instead, so the caller can
+    send them through transcribe and get the same text as without batching.
+    """
+    extractor = model.feature_extractor
+    features = []
+    for audio in audios:
+        f = extractor(audio)[:, : extractor.nb_max_frames]
+        features.append(np.pad(f, ((0, 0), (0, extractor.nb_max_frames - f.shape[-1]))))
+
+    encoder_output = model.encode(np.stack(features))
+
+    prompts = []
+    for language in languages:
+        tokenizer = Tokenizer(
+            model.hf_tokenizer,
+            model.model.is_multilingual,
+            task="transcribe",
+            language=language,
+        )
+        prompts.append(list(tokenizer.sot_sequence) + [tokenizer.no_timestamps])
+
+    results = model.model.generate(
+        encoder_output,
+        prompts,
+        beam_size=beam_size,
+        length_penalty=1,
+        max_length=MAX_DECODE_TOKENS,
+        return_scores=True,
+        return_no_speech_prob=True,
+        suppress_blank=True,
+        suppress_tokens=list(suppress_tokens),
+    )
+
+    texts = []
+    for result in results:
+        tokens = result.sequences_ids[0]
+        # The score is the sum of the token log probabilities over the length,
+        # faster-whisper averages over the length plus one
+        avg_logprob = result.scores[0] * len(tokens) / (len(tokens) + 1)
+        if (
+            result.no_speech_prob > no_speech_threshold
+            and avg_logprob < log_prob_threshold
+        ):
+            texts.append("")
+            continue
+
+        text = tokenizer.decode(tokens).strip()
+        if (
+            avg_logprob < log_prob_threshold
+            or compression_ratio(text) > compression_ratio_threshold
+        ):
+            texts.append(None)
+        else:
+            texts.append(text)
+    return texts
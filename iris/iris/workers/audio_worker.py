@@ -1,12 +1,12 @@
 import logging
+import queue
 import traceback
-from collections import deque
 
-import numpy as np
 import pyaudio
-import torch
 
+from iris.audio_buffer import AudioBuffer
 from iris.data_types import OutputChannel, ProcessArgs, RecorderState, VoiceChunkMsg
+from iris.vad_model import VADState, get_vad_model, speech_probs
 from iris.workers.base_worker import IRISWorker
 
 CHUNK_SECONDS = 5
@@ -17,9 +17,8 @@ class AudioWorker(IRISWorker):
         # self.audio_queue = audio_queue
 
         # For some reason this has to come before the audio is initialized
-        self.model, utils = torch.hub.load(
-            repo_or_dir="snakers4/silero-vad", model="silero_vad"
-        )
+        get_vad_model()
+        self.vad_state = VADState()
 
         self.args = args
         self.audio_interface = pyaudio.PyAudio()
@@ -43,20 +42,15 @@ class AudioWorker(IRISWorker):
         )
 
         self.recording = False
+        self.is_overloaded = False
+        self.frames_since_overload_check = 0
         self.vad_countdown = 0
-        self.buffer = []
         self.first_pause = True
         self.counter = 0
-        self.rolling_buffer = deque(maxlen=int(self.frames_per_second / 2))
-
-    def process_stream(self, sound):
-        audio_int16 = np.frombuffer(sound, np.int16)
-        abs_max = np.abs(audio_int16).max()
-        sound = audio_int16.astype(np.float32)
-        if abs_max > 0:
-            sound *= 1 / 32768
-        sound = sound.squeeze()  # depends on the use case
-        return sound
+        # Holds half a second of pre-roll plus the recording
+        self.buffer = AudioBuffer(
+            preroll_samples=int(self.frames_per_second / 2) * args.settings.buffer_size
+        )
 
     def send_audio(self, audio, speaker=None, timestamps=[0]):
         is_tts = self.args.is_tts_mode.is_set()
@@ -64,27 +58,30 @@ class AudioWorker(IRISWorker):
         if is_tts:
             self.args.pause_recording_event.set()
 
-        self.audio_out_q.put(
-            VoiceChunkMsg(
-                audio=audio,
-                msg_lang=(
-                    self.args.settings.user_lang
-                    if is_tts
-                    else self.args.settings.external_lang
-                ),
-                target_lang=(
-                    self.args.settings.external_lang
-                    if is_tts
-                    else self.args.settings.user_lang
-                ),
-                channel=OutputChannel.TTS if is_tts else OutputChannel.SUB,
-                speaker=speaker,
-                timestamps=timestamps,
-                count=self.counter,
-            )
+        msg = VoiceChunkMsg(
+            audio=audio,
+            msg_lang=(
+                self.args.settings.user_lang
+                if is_tts
+                else self.args.settings.external_lang
+            ),
+            target_lang=(
+                self.args.settings.external_lang
+                if is_tts
+                else self.args.settings.user_lang
+            ),
+            channel=OutputChannel.TTS if is_tts else OutputChannel.SUB,
+            speaker=speaker,
+            timestamps=timestamps,
+            count=self.counter,
         )
 
-        print(f"Sent message {self.counter}")
+        try:
+            self.audio_out_q.put_nowait(msg)
+            print(f"Sent message {self.counter}")
+        except queue.Full:
+            print(f"Transcription queue full, dropped message {self.counter}")
+        self.update_overload_state()
 
         self.args.ui_update_q.put(
             {"set_recording_state": {"state": RecorderState.LISTENING}}
@@ -92,6 +89,17 @@ class AudioWorker(IRISWorker):
 
         self.counter += 1
 
+    def update_overload_state(self):
+        try:
+            depth = self.audio_out_q.qsize()
+            overloaded = depth >= self.args.settings.overload_queue_depth
+        except NotImplementedError:
+            # qsize isn't available on macOS, only a full queue counts there
+            overloaded = self.audio_out_q.full()
+        if overloaded != self.is_overloaded:
+            self.is_overloaded = overloaded
+            self.args.ui_update_q.put({"set_overload_state": {"state": overloaded}})
+
     def vad(self, aud):
         if self.args.pause_recording_event.is_set():
             if self.first_pause:
@@ -100,7 +108,7 @@ class AudioWorker(IRISWorker):
                 )
             first_pause = False
             if len(self.buffer) > 0:
-                self.buffer = []
+                self.buffer.clear()
             return
         elif self.first_pause is False:
             self.args.ui_update_q.put(
@@ -109,12 +117,17 @@ class AudioWorker(IRISWorker):
 
         first_pause = True
 
-        vad = self.model(torch.from_numpy(self.process_stream(aud)), 16000).item()
+        frame = self.buffer.write(aud)
+        vad = speech_probs([frame], [self.vad_state])[0]
 
         if (
             vad >= self.args.settings.silero_threshold and not self.recording
         ) or vad >= 0.8:
-            over_time = len(self.buffer) / self.frames_per_second
+            over_time = (
+                self.buffer.recorded_samples
+                / self.args.settings.buffer_size
+                / self.frames_per_second
+            )
             if over_time >= CHUNK_SECONDS + 1 and not self.args.is_tts_mode.is_set():
                 diff = over_time - CHUNK_SECONDS
                 self.vad_countdown = int(self.frames_per_second * (1 / diff))
@@ -137,19 +150,13 @@ class AudioWorker(IRISWorker):
             self.recording = False
 
         if self.recording:
-            self.buffer.append(aud)
+            self.buffer.commit(recording=True)
 
-        elif len(self.buffer) != 0:
-            audio = self.process_stream(
-                np.frombuffer(
-                    b"".join(list(self.rolling_buffer) + self.buffer), dtype=np.int16
-                )
-            )
-            self.send_audio(audio)
+        elif self.buffer.recorded_samples != 0:
+            self.send_audio(self.buffer.get_audio())
             self.buffer.clear()
-            self.rolling_buffer.clear()
         else:
-            self.rolling_buffer.append(aud)
+            self.buffer.commit(recording=False)
 
     def _run(self) -> None:
         try:
@@ -176,6 +183,12 @@ class AudioWorker(IRISWorker):
 
                 self.vad(data)
 
+                # Also checked between clips so the UI hears when a backlog clears
+                self.frames_since_overload_check += 1
+                if self.frames_since_overload_check >= self.frames_per_second:
+                    self.frames_since_overload_check = 0
+                    self.update_overload_state()
+
         except KeyboardInterrupt:
             logging.debug(
                 "Audio data worker process " "finished due to KeyboardInterrupt"
@@ -6,6 +6,9 @@ import faster_whisper
 import torch.multiprocessing as mp
 
 from iris.data_types import OutputChannel, ProcessArgs, TranscriptionMsg, VoiceChunkMsg
+from iris.profiles import get_profile
+from iris.queues import drain
+from iris.whisper_batch import can_batch, transcribe_batch
 from iris.workers.base_worker import IRISWorker
 
 
@@ -13,43 +16,88 @@ class WhisperWorker(IRISWorker):
     def __init__(self, audio_q: mp.Queue, args: ProcessArgs):
         self.audio_q = audio_q
         self.args = args
+        compute_type = self.args.settings.compute_type
+        if compute_type == "default":
+            compute_type = get_profile(
+                self.args.settings.performance_profile,
+                self.args.settings.whisper_device,
+            ).whisper_compute_type
         self.model = faster_whisper.WhisperModel(
             model_size_or_path=self.args.settings.model_path,
             device=self.args.settings.whisper_device,
-            compute_type=self.args.settings.compute_type,
+            compute_type=compute_type,
             device_index=self.args.settings.gpu_device_index,
             cpu_threads=4,
             # num_workers=4,
         )
 
-    def _run(self) -> None:
-        msg: VoiceChunkMsg
-        for msg in iter(self.audio_q.get, None):
-            print(f"received message {msg.count}")
-            segments, info = self.model.transcribe(
-                msg.audio,
-                language=msg.msg_lang,
+    def transcribe(self, msg: VoiceChunkMsg) -> str:
+        segments, info = self.model.transcribe(
+            msg.audio,
+            language=msg.msg_lang,
+            beam_size=self.args.settings.beam_size,
+            initial_prompt=self.args.settings.initial_prompt,
+            suppress_tokens=self.args.settings.suppress_tokens,
+            word_timestamps=True,
+            clip_timestamps=msg.timestamps,
+            # repetition_penalty=0,
+        )
+
+        transcription = " ".join(seg.text for seg in segments)
+        return transcription.strip()
+
+    def transcribe_batch(self, batch: list[VoiceChunkMsg]) -> list[str]:
+        # Diarized chunks point at a slice of the audio and need clip_timestamps,
+        # and prompted decoding isn't supported by the batched path
+        batchable = [
+            i
+            for i, msg in enumerate(batch)
+            if msg.timestamps == [0]
+            and can_batch(msg.audio)
+            and not self.args.settings.initial_prompt
+        ]
+        texts = {}
+        if len(batchable) > 1:
+            out = transcribe_batch(
+                self.model,
+                [batch[i].audio for i in batchable],
+                [batch[i].msg_lang for i in batchable],
                 beam_size=self.args.settings.beam_size,
-                initial_prompt=self.args.settings.initial_prompt,
                 suppress_tokens=self.args.settings.suppress_tokens,
-                word_timestamps=True,
-                clip_timestamps=msg.timestamps,
-                # repetition_penalty=0,
             )
+            # None means it needs transcribe()'s temperature fallback
+            texts = {i: t for i, t in zip(batchable, out) if t is not None}
 
-            transcription = " ".join(seg.text for seg in segments)
-            transcription = transcription.strip()
-            self.args.ui_update_q.put(
-                {
-                    "add_transcription": {
-                        "msg": TranscriptionMsg(
-                            msg_lang=msg.msg_lang,
-                            target_lang=msg.target_lang,
-                            speaker=msg.speaker,
-                            time_start=msg.time_start,
-                            text=transcription,
-                            channel=msg.channel,
-                        )
-                    }
-                }
+        return [
+            texts[i] if i in texts else self.transcribe(msg)
+            for i, msg in enumerate(batch)
+        ]
+
+    def _run(self) -> None:
+        batch: list[VoiceChunkMsg]
+        done = False
+        while not done:
+            batch, done = drain(
+                self.audio_q,
+                self.args.settings.batch_size,
+                self.args.settings.batch_wait,
             )
+            if not batch:
+                continue
+
+            print(f"received messages {[msg.count for msg in batch]}")
+            for msg, transcription in zip(batch, self.transcribe_batch(batch)):
+                self.args.ui_update_q.put(
+                    {
+                        "add_transcription": {
+                            "msg": TranscriptionMsg(
+                                msg_lang=msg.msg_lang,
+                                target_lang=msg.target_lang,
+                                speaker=msg.speaker,
+                                time_start=msg.time_start,
+                                text=transcription,
+                                channel=msg.channel,
+                            )
+                        }
+                    }
+                )
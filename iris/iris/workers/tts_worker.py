@@ -1,7 +1,7 @@
 import sounddevice
-from transformers import pipeline
-
 from iris.data_types import ProcessArgs, TTSMsg
+from iris.model_registry import configure_registry, get_pipeline, registry
+from iris.profiles import get_profile
 from iris.workers.base_worker import IRISWorker
 
 TTS_LANG_MAP = {
@@ -16,29 +16,56 @@ class TTSWorker(IRISWorker):
         self.args = args
         self.tts_in_q = tts_in_q
 
-        if self.args.settings.external_lang in TTS_LANG_MAP:
-            self.tts_pipe = pipeline(
+        settings = args.settings
+        configure_registry(settings)
+        self.tts_precision = get_profile(
+            settings.performance_profile, settings.tts_device
+        ).translation_precision
+        self.trans_precision = get_profile(
+            settings.performance_profile, settings.translation_device
+        ).translation_precision
+        if settings.external_lang in TTS_LANG_MAP:
+            self.tts_model = f"facebook/mms-tts-{TTS_LANG_MAP[settings.external_lang]}"
+            self.tts_trans_model = (
+                f"Helsinki-NLP/opus-mt-{settings.user_lang}-{settings.external_lang}"
+            )
+            registry.warmup(
                 "text-to-speech",
-                model=f"facebook/mms-tts-{TTS_LANG_MAP[self.args.settings.external_lang]}",
-                device=args.settings.tts_device,
+                self.tts_model,
+                settings.tts_device,
+                self.tts_precision,
             )
-            self.tts_trans_pipe = pipeline(
+            registry.warmup(
                 "translation",
-                model=f"Helsinki-NLP/opus-mt-{self.args.settings.user_lang}-{self.args.settings.external_lang}",
-                device=args.settings.translation_device,
+                self.tts_trans_model,
+                settings.translation_device,
+                self.trans_precision,
             )
         else:
-            self.tts_pipe = None
-            self.tts_trans_pipe = None
+            self.tts_model = None
+            self.tts_trans_model = None
 
     def _run(self) -> None:
-        if not self.tts_pipe:
+        if not self.tts_model:
             raise Exception()
 
+        settings = self.args.settings
         msg: TTSMsg
         for msg in iter(self.tts_in_q.get, None):
-            translated = self.tts_trans_pipe(msg.text)[0]["translation_text"]
-            out = self.tts_pipe(translated)
+            tts_trans_pipe = get_pipeline(
+                "translation",
+                self.tts_trans_model,
+                settings.translation_device,
+                self.trans_precision,
+            )
+            tts_pipe = get_pipeline(
+                "text-to-speech",
+                self.tts_model,
+                settings.tts_device,
+                self.tts_precision,
+            )
+            translated = tts_trans_pipe(msg.text)[0]["translation_text"]
+            out = tts_pipe(translated)
             self.args.pause_recording_event.set()
             sounddevice.play(
                 out["audio"][0], samplerate=out["sampling_rate"], blocking=True
@@ -12,6 +12,7 @@ from scipy.io.wavfile import write
 from torchaudio.io import StreamReader
 
 from iris.data_types import OutputChannel, ProcessArgs, RecorderState, VoiceChunkMsg
+from iris.vad_model import VADState, get_vad_model, speech_probs
 from iris.workers.base_worker import IRISWorker
 
 CHUNK_SECONDS = 5
@@ -81,9 +82,8 @@ class VADWorker(IRISWorker):
         )
         self.dp = DiarizationProcessor(args.settings, self.send_audio)
 
-        self.model, utils = torch.hub.load(
-            repo_or_dir="snakers4/silero-vad", model="silero_vad"
-        )
+        get_vad_model()
+        self.vad_state = VADState()
 
         self.recording = False
         self.vad_countdown = 0
@@ -153,7 +153,7 @@ class VADWorker(IRISWorker):
 
             first_pause = True
 
-            vad = self.model(torch.from_numpy(self.process_stream(aud)), 16000).item()
+            vad = speech_probs([self.process_stream(aud)], [self.vad_state])[0]
 
             if (
                 vad >= self.args.settings.silero_threshold and not self.recording
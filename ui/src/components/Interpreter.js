@@ -1,15 +1,26 @@
 import React, { useState, useRef, useEffect, useContext } from "react";
 import { Mic, MicOff } from "lucide-react";
 import Message from "./Message";
-import { Button, Center, Spinner, Flex, Box, Divider } from "@chakra-ui/react";
-import { UserContext } from "../context.js";
+import {
+  Button,
+  Center,
+  Spinner,
+  Flex,
+  Box,
+  Divider,
+  useToast,
+} from "@chakra-ui/react";
+import { TranslationsContext, UserContext } from "../context.js";
 import InstructionModal from "./InstructionModal";
 
 import Recoder from "opus-recorder";
 
 const Interpreter = ({ client, showInstructions }) => {
   const [isRecording, setIsRecording] = useState(false);
+  const [isOverloaded, setIsOverloaded] = useState(false);
   const ws = useRef(null);
+  // Utterances that came to nothing. Partials for them can still be in flight.
+  const discarded = useRef(new Set());
   const [sentMsg, setSentMsg] = useState([]);
 
   // TODO: Need to get rid of this
@@ -22,6 +33,11 @@ const Interpreter = ({ client, showInstructions }) => {
   const micStreams = useRef([]);
 
   const user = useContext(UserContext);
+  const t = useContext(TranslationsContext);
+  // The socket handler is only set up once, so it reads these through refs
+  const tRef = useRef(t);
+  tRef.current = t;
+  const toast = useToast();
 
   useEffect(() => {
     if (!isVisible) return;
@@ -72,14 +88,38 @@ const Interpreter = ({ client, showInstructions }) => {
     if (ws.current && ws.current.readyState === WebSocket.OPEN) return;
     if (!oggRecorder) return;
 
+    const decoder = new TextDecoder();
     const wsEvent = (event) => {
-      const msg = JSON.parse(event.data);
-      if (msg.id) {
+      const data =
+        typeof event.data === "string" ? event.data : decoder.decode(event.data);
+      const msg = JSON.parse(data);
+      if (msg.status) {
+        // Transcription is backed up, new recordings may be slow or dropped
+        setIsOverloaded(msg.status.overloaded);
+        if (msg.status.rejected) {
+          toast({
+            title: tRef.current(
+              "The server is busy, your message was not sent. Please try again."
+            ),
+            status: "warning",
+            duration: 5000,
+          });
+        }
+      }
+      if (msg.is_discarded) {
+        discarded.current.add(msg.id);
+        setSentMsg((oldArray) => oldArray.filter((m) => m.id !== msg.id));
+      } else if (msg.id && !discarded.current.has(msg.id)) {
         if (
-          msg.is_accepted &&
-          (msg.user === user.name || msg.language !== user.language)
+          (msg.is_partial && msg.user === user.name) ||
+          (msg.is_accepted &&
+            (msg.user === user.name || msg.language !== user.language))
         ) {
-          setSentMsg((oldArray) => [JSON.parse(event.data), ...oldArray]);
+          // Partial transcripts are replaced by later versions with the same id
+          setSentMsg((oldArray) => [
+            msg,
+            ...oldArray.filter((m) => m.id !== msg.id),
+          ]);
           if (msg.user !== user.name) {
             // if (msg.translated_text[user.language] && isConversationMode) {
             //   sayTTS(msg, user.language);
@@ -99,9 +139,10 @@ const Interpreter = ({ client, showInstructions }) => {
     }
     new_uri += "//" + loc.host;
 
-    const whisper_ws = new_uri + "/api/ws-whisper";
+    const whisper_ws = new_uri + "/api/ws-whisper?encoding=json-binary";
 
     ws.current = new WebSocket(whisper_ws);
+    ws.current.binaryType = "arraybuffer";
     ws.current.addEventListener("message", wsEvent);
 
     oggRecorder.ondataavailable = (data) => {
@@ -220,7 +261,9 @@ const Interpreter = ({ client, showInstructions }) => {
             onTouchEnd={stopRecording}
             onTouchCancel={stopRecording}
             onTouchMove={(e) => e.preventDefault()}
-            colorScheme={isRecording ? "green" : "red"}
+            colorScheme={
+              isRecording ? "green" : isOverloaded ? "orange" : "red"
+            }
             isDisabled={!oggRecorder || !wsReady}
             size={"lg"}
             height={"125px"}
@@ -47,8 +47,12 @@ const Message = ({ message, acceptMsg, user, sayTTS }) => {
 
   const edit = <Textarea onChange={handleInputChange} value={editText} />;
 
+  // Partials aren't stored yet and get replaced by the final, so there is
+  // nothing to correct until it arrives
+  const ownFinal = message.user === user.name && !message.is_partial;
+
   const leftButton = () => {
-    if (message.user === user.name) {
+    if (ownFinal) {
       if (editMode) {
         return (
           <Button>
@@ -66,7 +70,7 @@ const Message = ({ message, acceptMsg, user, sayTTS }) => {
   };
 
   const rightButton = () => {
-    if (message.user === user.name) {
+    if (ownFinal) {
       if (editMode) {
         return (
           <Button